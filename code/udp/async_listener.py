@@ -0,0 +1,181 @@
+"""
+async_listener implements a server that serves many AsyncRDT clients on one
+datagram endpoint of an event loop. It demultiplexes the datagrams by their
+connection ID as RDTListener does, every connection is an AsyncRDT that holds
+the state of its peer alone, so thousands of connections share one thread.
+"""
+
+
+import asyncio
+import contextlib
+import time
+from collections import deque
+from async_rdt import AsyncRDT, Notifier
+from listener import RDTConnection, RDTListener, IDLE_TIMEOUT, REAP_INTERVAL
+from rdt import CONGESTION_CONTROL, CHECKSUM, FEATURES, PACING
+
+
+class AsyncRDTConnection(RDTConnection, AsyncRDT):
+    """
+    This class implements the server end of a connection of an asynchronous
+    listener. It is an AsyncRDT whose datagrams are received by the listener,
+    it has its own sending task and timers and sends on the transport of the
+    listener. It follows its peer to a new address as RDTConnection does.
+    """
+
+    def __init__(self, listener, address, connection_id):
+        """
+        This function initializes the connection with the peer at address and
+        starts its sending task. The connection ID is given to the peer in the
+        handshake.
+        """
+        self.listener = listener
+        self.assigned_connection_id = connection_id
+        self.close_time = None
+        self.last_receive_time = time.monotonic()
+        AsyncRDT.__init__(
+            self,
+            True,
+            address,
+            listener.congestion_control,
+            listener.checksum_name,
+            listener.features,
+            listener.pacing,
+        )
+        self.connection_made(listener.transport)
+
+    def shutdown(self):
+        """
+        This function stops the sending task and the timers of the connection
+        and wakes up the tasks that wait for data.
+        """
+        super().shutdown()
+        self.sending_task.cancel()
+
+
+class AsyncRDTListener(RDTListener, asyncio.DatagramProtocol):
+    """
+    This class implements a server that accepts many AsyncRDT connections on
+    one datagram endpoint. The event loop hands every datagram to the
+    connection of its connection ID, an initial message from an unknown peer
+    creates a new connection that is returned by accept.
+
+    It uses the following attributes in addition to the attributes of
+    RDTListener, but the socket, the batched I/O and the receiving thread:
+    transport: The datagram transport of the listener.
+    reap_handle: The handle of the next removal of the closed connections, or None.
+    """
+
+    def __init__(
+        self,
+        congestion_control=CONGESTION_CONTROL,
+        checksum=CHECKSUM,
+        features=FEATURES,
+        pacing=PACING,
+    ):
+        """
+        This function initializes the listener. It must be created in the
+        event loop, the socket is given by the transport.
+        Use create_rdt_listener to create the endpoint and the listener.
+        """
+        self.congestion_control = congestion_control
+        self.checksum_name = checksum
+        self.features = features
+        self.pacing = pacing
+        # The received datagrams are bytes objects, they are not pooled.
+        self.buffer_pool = None
+        self.connections = {}
+        self.peers = {}
+        self.idle_timeout = IDLE_TIMEOUT
+        self.accept_queue = deque()
+        self.mutex = contextlib.nullcontext()
+        self.accept_condition = Notifier()
+        self.transport = None
+        self.reap_handle = None
+
+    def connection_made(self, transport):
+        """
+        This function is called by the event loop when the transport is ready.
+        It starts the removal of the closed connections.
+        """
+        self.transport = transport
+        self.reap_closed()
+
+    def connection_lost(self, exc):
+        """
+        This function is called by the event loop when the transport is closed.
+        It shuts down every connection.
+        """
+        if self.reap_handle is not None:
+            self.reap_handle.cancel()
+        for connection in self.connections.values():
+            connection.shutdown()
+        self.connections.clear()
+        self.peers.clear()
+
+    def datagram_received(self, data, address):
+        """
+        This function is called by the event loop with every received datagram.
+        It hands the datagram to its connection.
+        """
+        connection = self.route(memoryview(data), address)
+        if connection is not None:
+            connection.datagram_received(data, address)
+
+    def error_received(self, exc):
+        """
+        This function is called by the event loop when a send or receive
+        operation fails. A datagram is lost, the retransmissions recover it.
+        """
+
+    def create_connection(self, address, connection_id):
+        """
+        This function creates the connection of the peer at address with the
+        connection ID assigned to it.
+        """
+        return AsyncRDTConnection(self, address, connection_id)
+
+    def reap_closed(self):
+        """
+        This function removes the closed connections and schedules the next
+        removal after REAP_INTERVAL seconds.
+        """
+        self.reap()
+        self.reap_handle = asyncio.get_running_loop().call_later(
+            REAP_INTERVAL, self.reap_closed
+        )
+
+    async def accept(self):
+        """
+        This function is called by the upper layer to wait for a new connection.
+        It returns the connection.
+        """
+        while len(self.accept_queue) == 0:
+            await self.accept_condition.wait()
+        return self.accept_queue.popleft()
+
+    def close(self):
+        """
+        This function closes the transport of the listener, which shuts down
+        every connection.
+        """
+        self.transport.close()
+
+
+async def create_rdt_listener(
+    local_address,
+    congestion_control=CONGESTION_CONTROL,
+    checksum=CHECKSUM,
+    features=FEATURES,
+    pacing=PACING,
+):
+    """
+    This function creates a datagram endpoint bound to local_address that
+    accepts AsyncRDT connections.
+    """
+    loop = asyncio.get_running_loop()
+    _, listener = await loop.create_datagram_endpoint(
+        lambda: AsyncRDTListener(congestion_control, checksum, features, pacing),
+        local_addr=local_address,
+    )
+    return listener
@@ -0,0 +1,390 @@
+"""
+async_rdt implements RDT on asyncio. AsyncRDT is a datagram protocol that runs
+in an event loop instead of a sending thread, a receiving thread and a timer
+thread, so many connections share one thread. It reuses the protocol logic of
+RDT and sends the same segments, so it interoperates with RDT on the wire.
+"""
+
+
+import asyncio
+import contextlib
+import errno
+import socket
+from buffer_pool import BufferPool
+from timer_wheel import LoopTimers
+from pmtu import set_dont_fragment
+from rdt import RDT, CONGESTION_CONTROL, CHECKSUM, FEATURES, PACING
+from sequence import seq_add
+
+
+class Notifier:
+    """
+    This class wakes up a task of the event loop. It stands for the condition
+    variables of RDT: the protocol logic calls notify, the tasks wait.
+
+    A notification is kept until the next wait, so it is not lost if no task
+    is waiting yet. The tasks check their condition again after they wake up.
+
+    It uses the following attributes:
+    event: The event that is set by notify.
+    """
+
+    def __init__(self):
+        """
+        This function initializes the notifier.
+        """
+        self.event = asyncio.Event()
+
+    def notify(self):
+        """
+        This function wakes up the tasks that wait.
+        """
+        self.event.set()
+
+    def notify_all(self):
+        """
+        This function wakes up the tasks that wait, as notify does.
+        """
+        self.event.set()
+
+    async def wait(self):
+        """
+        This function waits for the next notification.
+        """
+        await self.event.wait()
+        self.event.clear()
+
+
+class AsyncRDT(RDT, asyncio.DatagramProtocol):
+    """
+    This class implements the RDT protocol on asyncio. It is used by the upper
+    layer to send and receive segments with await send and await recv.
+
+    The event loop calls the protocol logic of RDT from datagram_received and
+    from the timer wheel, a task sends the data in the send buffer. All of
+    them run in the event loop, so the mutex and the other locks are not
+    needed.
+
+    It uses the following attributes in addition to the attributes of RDT:
+    transport: The datagram transport of the connection.
+    sending_task: The task that sends the data in the send buffer.
+    """
+
+    def __init__(
+        self,
+        is_server=True,
+        address=None,
+        congestion_control=CONGESTION_CONTROL,
+        checksum=CHECKSUM,
+        features=FEATURES,
+        pacing=PACING,
+    ):
+        """
+        This function initializes the AsyncRDT object. It takes a boolean
+        indicating whether the object is a server or a client, the address
+        of the other end of the connection, the name of the congestion
+        control algorithm, the name of the preferred checksum, the bitmask
+        of the offered features and the pacing as input.
+
+        It must be created in the event loop, the socket is given by the
+        transport when the connection is made.
+        """
+        super().__init__(
+            None, is_server, address, congestion_control, checksum, features, pacing
+        )
+
+    def start(self):
+        """
+        This function creates the timers and the notifiers of the connection.
+        The sending task starts when the transport is ready.
+        """
+        # The received datagrams are bytes objects, they are not pooled.
+        self.buffer_pool = BufferPool(self.buffer_size, max_free=0)
+        self.timers = LoopTimers(self.resend)
+        self.mutex = contextlib.nullcontext()
+        self.send_buffer_lock = contextlib.nullcontext()
+        self.recv_lock = contextlib.nullcontext()
+        self.init_condition = Notifier()
+        self.close_condition = Notifier()
+        self.sending_condition = Notifier()
+        self.recv_condition = Notifier()
+        self.writable_condition = Notifier()
+        self.is_dont_fragment = False
+        self.transport = None
+        self.sending_task = None
+
+    def connection_made(self, transport):
+        """
+        This function is called by the event loop when the transport is ready.
+        It sets the don't fragment bit on the socket and starts the sending task.
+        """
+        self.transport = transport
+        self.is_dont_fragment = set_dont_fragment(transport.get_extra_info("socket"))
+        self.sending_task = asyncio.get_running_loop().create_task(
+            self.sending_task_func()
+        )
+
+    def connection_lost(self, exc):
+        """
+        This function is called by the event loop when the transport is closed.
+        The tasks that wait for data are woken up, the connection is closed.
+        """
+        self.timers.stop()
+        if self.sending_task is not None:
+            self.sending_task.cancel()
+        self.exit_flag = True
+        self.recv_condition.notify_all()
+
+    def datagram_received(self, data, address):
+        """
+        This function is called by the event loop with every received datagram.
+        It verifies the message and handles it as the receiving thread of RDT.
+        """
+        message = self.verify_message(memoryview(data))
+        if message is not None:
+            self.message_handler(*message, address)
+
+    def error_received(self, exc):
+        """
+        This function is called by the event loop when a send or receive
+        operation fails. A datagram is lost, the retransmissions recover it.
+        """
+
+    def _send(self, msg, address):
+        """
+        Sends a message to the specified address. The transport buffers the
+        message if the socket is not writable.
+        """
+        self.transport.sendto(msg, address)
+
+    def flush(self):
+        """
+        This function does nothing, the messages are handed to the transport
+        when they are sent.
+        """
+
+    async def sending_task_func(self):
+        """
+        This function is the sending task. It sends the data in the send buffer
+        to the other end of the connection up to the window size.
+
+        It also handles the close procedure as the sending thread of RDT. If
+        the object is a client, it returns when the send buffer is empty, the
+        close flag is set and every message is acked, or when the connection
+        is aborted.
+        """
+        while not self.exit_flag:
+            if self.lost_messages:
+                if self.in_flight() < self.send_window():
+                    self.resend_lost_message()
+                else:
+                    await self.sending_condition.wait()
+                continue
+
+            if len(self.send_buffer) == 0 and not self.close_flag:
+                await self.sending_condition.wait()
+                continue
+
+            elif len(self.send_buffer) == 0 and self.close_flag:
+                self.close_condition.notify()
+                if self.is_server:
+                    self.sending_ended = True
+                    await self.sending_condition.wait()
+                    continue
+                elif self.waiting_for_ack_buffer:
+                    await self.sending_condition.wait()
+                    continue
+                else:
+                    return
+
+            if not self.can_send_segment():
+                await self.sending_condition.wait()
+                continue
+
+            delay = self.coalescing_delay_left()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            delay = self.pacing_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            self.send_segment()
+            if self.is_send_blocked and self.is_writable():
+                self.notify_writable()
+
+    def notify_writable(self):
+        """
+        This function is called by the sending task when the send buffer is
+        writable again. It calls the writable callback.
+        """
+        self.is_send_blocked = False
+        if self.writable_callback is not None:
+            self.writable_callback()
+
+    async def initialize_connection(self):
+        """
+        This function is called by the client to initialize the connection
+        with the server. It sends an initial message to the server and waits
+        for the reply. If the reply is not received within a certain time, the
+        message is resent. It returns False if the server never replies.
+        """
+        msg = self.initial_message()
+        self._send(msg, self.address)
+        self.waiting_for_ack_buffer[self.id] = msg
+        self.start_timer(self.id)
+        self.id = seq_add(self.id, 1)
+        self.peer_ack = self.id
+        while not self.is_connected:
+            if self.exit_flag:
+                print(f"Connection failed with {self.address}")
+                return False
+            await self.init_condition.wait()
+        print(f"Connection initialized with {self.address}")
+        return True
+
+    async def close(self):
+        """
+        This function is called by the upper layer in the client to close the
+        connection. It waits until the send buffer is sent and every data
+        segment is acked, sends a close message, waits for its ack and closes
+        the transport. An aborted connection only closes the transport.
+        """
+        self.close_flag = True
+        self.stop_path_mtu_discovery()
+        self.sending_condition.notify()
+        await self.sending_task
+        while self.waiting_for_ack_buffer:
+            await self.close_condition.wait()
+        if self.exit_flag:
+            self.transport.close()
+            return
+
+        id = self.id
+        checksum = self.compute_checksum("c", id, 0, b"")
+        msg = self.message_formatter("c", id, 0, checksum, b"")
+        self.waiting_for_ack_buffer[id] = msg
+        self.start_timer(id)
+        self.id = seq_add(self.id, 1)
+        self._send(msg, self.address)
+        self.is_close_sent = True
+
+        while not self.exit_flag:
+            await self.close_condition.wait()
+        self.timers.stop()
+        self.transport.close()
+
+    async def send(self, msg, address, block=True, timeout=None):
+        """
+        This function is called by the upper layer to send data to the network.
+        It waits for room in the send buffer as send_many does. It returns
+        False if the connection is closing.
+        """
+        return await self.send_many([msg], address, block, timeout) == 1
+
+    async def send_many(self, msgs, address, block=True, timeout=None):
+        """
+        This function is called by the upper layer to send a list of messages
+        to the network, as RDT.send_many does. It waits for room in the send
+        buffer unless block is False, for at most timeout seconds if it is
+        given.
+        """
+        self.check_segment_size(msgs)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        queued = 0
+        while True:
+            if self.close_flag:
+                return queued or False
+            self.address = address
+            queued += self.queue_messages(msgs, queued)
+            if queued == len(msgs):
+                return queued
+
+            self.is_send_blocked = True
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - loop.time()
+            if not block or (remaining is not None and remaining <= 0):
+                if queued:
+                    return queued
+                if not block:
+                    raise BlockingIOError(errno.EWOULDBLOCK, "the send buffer is full")
+                raise socket.timeout("timed out")
+            try:
+                await asyncio.wait_for(self.writable_condition.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def recv(self):
+        """
+        This function is called by the upper layer to receive data from the
+        network. It waits until data is received. Data is received in the
+        order it is sent.
+        """
+        message, address = await self.recv_view()
+        return bytes(message), address
+
+    async def recv_view(self):
+        """
+        This function is called by the upper layer to receive data from the
+        network as a memoryview, as RDT.recv_view does. It raises
+        ConnectionError if the connection is closed and nothing is left to
+        read.
+        """
+        while len(self.recv_buffer) == 0:
+            if self.exit_flag:
+                raise ConnectionError("the connection is closed")
+            await self.recv_condition.wait()
+        return self.take_received()
+
+    def __aiter__(self):
+        """
+        This function returns the asynchronous iterator of the received data.
+        """
+        return self
+
+    async def __anext__(self):
+        """
+        This function returns the next received data and its address. The
+        iteration ends when the connection is closed.
+        """
+        try:
+            return await self.recv()
+        except ConnectionError:
+            raise StopAsyncIteration
+
+
+async def create_rdt_endpoint(
+    is_server=True,
+    local_address=None,
+    address=None,
+    congestion_control=CONGESTION_CONTROL,
+    checksum=CHECKSUM,
+    features=FEATURES,
+    pacing=PACING,
+):
+    """
+    This function creates a datagram endpoint that runs AsyncRDT. A server is
+    bound to local_address, a client initializes the connection with the
+    server at address before it is returned.
+    """
+    if not is_server and address is None:
+        raise ValueError("address cannot be None")
+    family = 0
+    if local_address is None and address is not None:
+        family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+
+    loop = asyncio.get_running_loop()
+    _, rdt = await loop.create_datagram_endpoint(
+        lambda: AsyncRDT(
+            is_server, address, congestion_control, checksum, features, pacing
+        ),
+        local_addr=local_address,
+        family=family,
+    )
+    if not is_server:
+        await rdt.initialize_connection()
+    return rdt
@@ -0,0 +1,174 @@
+"""
+This module implements RDT+ protocol on asyncio. It is using AsyncRDT as a base
+and splits, interleaves and reassembles the objects as RDTPlus does, so it
+interoperates with RDTPlus on the wire.
+"""
+
+from async_listener import create_rdt_listener
+from async_rdt import create_rdt_endpoint
+from rdt import CONGESTION_CONTROL, CHECKSUM, FEATURES, PACING
+from rdt_plus import RDTPlus, SCHEDULER
+from scheduler import create_scheduler
+
+
+class AsyncRDTPlus(RDTPlus):
+    """
+    This class implements RDT+ protocol on asyncio. It is used by the upper
+    layer to send lists of objects with await send and to receive objects with
+    await recv or an async for loop.
+    """
+
+    def __init__(self, rdt, scheduler=SCHEDULER):
+        """
+        This method initializes RDT+ protocol over a connected AsyncRDT with
+        the name of the object scheduler.
+        Use create_rdt_plus_endpoint to create the endpoint and the protocol.
+        """
+        self._init_plus_state(rdt, scheduler)
+
+    async def send(self, msgs: list, address_port, priorities=None, weights=None):
+        """
+        This method sends a list of objects over the network.
+        It splits the objects into segments, interleave them and send them over the network.
+        It waits while the send buffer of the connection is full.
+        The priorities and weights of the objects are used as in RDTPlus.send.
+        """
+        messages = self._segment_objects(msgs, priorities, weights)
+        for batch in self._batch_messages(messages):
+            await self.rdt.send_many(batch, address_port)
+
+    async def send_stream(self, obj_id, source, size, address_port=None):
+        """
+        This method sends an object of size bytes that is read while it is
+        sent, as RDTPlus.send_stream does. The source is read in the event
+        loop, it should not block.
+        """
+        self._check_stream_id(obj_id)
+        if address_port is None:
+            address_port = self.rdt.address
+        messages = self._stream_messages(obj_id, source, size)
+        for batch in self._batch_messages(messages):
+            await self.rdt.send_many(batch, address_port)
+
+    async def recv_stream(self):
+        """
+        This method receives the objects over the network as streams, as
+        RDTPlus.recv_stream does. It is an asynchronous generator of
+        (obj_id, data, is_last, address) tuples, it ends when the connection
+        is closed.
+        """
+        while True:
+            try:
+                msg, address = await self.rdt.recv_view()
+            except ConnectionError:
+                return
+            for chunk in self._receive_stream_segment(msg, address):
+                yield chunk
+
+    async def recv(self):
+        """
+        This method receives the next completed object and returns it along
+        with the sender address. It raises ConnectionError if the connection
+        is closed.
+        """
+        while True:
+            msg, address = await self.rdt.recv_view()
+            object = self._receive_segment(msg, address)
+            if object is not None:
+                return object, address
+
+    async def close(self):
+        """
+        This method closes the connection.
+        """
+        await self.rdt.close()
+
+    def __aiter__(self):
+        """
+        This method returns the asynchronous iterator of the received objects.
+        """
+        return self
+
+    async def __anext__(self):
+        """
+        This method returns the next received object and its sender address.
+        The iteration ends when the connection is closed.
+        """
+        try:
+            return await self.recv()
+        except ConnectionError:
+            raise StopAsyncIteration
+
+
+async def create_rdt_plus_endpoint(
+    is_server=True,
+    local_address=None,
+    server_address_port=None,
+    congestion_control=CONGESTION_CONTROL,
+    checksum=CHECKSUM,
+    features=FEATURES,
+    pacing=PACING,
+    scheduler=SCHEDULER,
+):
+    """
+    This function creates a datagram endpoint that runs RDT+ over AsyncRDT. A
+    server is bound to local_address, a client is connected to the server at
+    server_address_port before it is returned.
+    """
+    rdt = await create_rdt_endpoint(
+        is_server,
+        local_address,
+        server_address_port,
+        congestion_control,
+        checksum,
+        features,
+        pacing,
+    )
+    return AsyncRDTPlus(rdt, scheduler)
+
+
+class AsyncRDTPlusListener:
+    """
+    This class implements a server that accepts many RDT+ connections on one
+    datagram endpoint of an event loop. It is using AsyncRDTListener as a base.
+    Use create_rdt_plus_listener to create the endpoint and the listener.
+    """
+
+    def __init__(self, listener, scheduler=SCHEDULER):
+        """
+        This method initializes RDT+ protocol over an AsyncRDTListener with
+        the name of the object scheduler of the connections.
+        """
+        create_scheduler(scheduler)
+        self.listener = listener
+        self.scheduler = scheduler
+
+    async def accept(self):
+        """
+        This method waits for a new connection and returns RDT+ protocol over it.
+        """
+        return AsyncRDTPlus(await self.listener.accept(), self.scheduler)
+
+    def close(self):
+        """
+        This method closes the listener and every connection.
+        """
+        self.listener.close()
+
+
+async def create_rdt_plus_listener(
+    local_address,
+    congestion_control=CONGESTION_CONTROL,
+    checksum=CHECKSUM,
+    features=FEATURES,
+    pacing=PACING,
+    scheduler=SCHEDULER,
+):
+    """
+    This function creates a datagram endpoint bound to local_address that
+    accepts RDT+ connections over AsyncRDT.
+    """
+    listener = await create_rdt_listener(
+        local_address, congestion_control, checksum, features, pacing
+    )
+    return AsyncRDTPlusListener(listener, scheduler)
@@ -0,0 +1,390 @@
+"""
+batch_io implements batched datagram I/O. RDT receives every datagram that is
+waiting on the socket in one batch and sends the segments that it queued in
+one burst. On Linux a batch is a single recvmmsg or sendmmsg system call made
+through ctypes, elsewhere it falls back to one recvfrom_into or sendto call
+per datagram.
+"""
+
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import struct
+
+BATCH_SIZE = 64
+
+# recvmmsg returns as soon as one datagram is received, the rest of the batch
+# is the datagrams that are already waiting (linux/socket.h).
+MSG_WAITFORONE = 0x10000
+
+# The size of struct sockaddr_storage, large enough for any address.
+SOCKADDR_SIZE = 128
+MAX_CACHED_ADDRESSES = 1024
+
+SOCKADDR_FAMILY = struct.Struct("=H")
+SOCKADDR_IN = struct.Struct("!H4s8x")
+SOCKADDR_IN6 = struct.Struct("!HI16s")
+SCOPE_ID = struct.Struct("=I")
+
+
+class iovec(ctypes.Structure):
+    """
+    This class is struct iovec of the C library.
+    """
+
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    """
+    This class is struct msghdr of the C library.
+    """
+
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    """
+    This class is struct mmsghdr of the C library.
+    """
+
+    _fields_ = [
+        ("msg_hdr", msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+def load_mmsg_functions():
+    """
+    This function returns the sendmmsg and recvmmsg functions of the C
+    library, or None if the platform does not have them.
+    """
+    library = ctypes.util.find_library("c")
+    if library is None:
+        return None
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        sendmmsg = libc.sendmmsg
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.POINTER(mmsghdr),
+        ctypes.c_uint,
+        ctypes.c_int,
+    ]
+    sendmmsg.restype = ctypes.c_int
+    recvmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.POINTER(mmsghdr),
+        ctypes.c_uint,
+        ctypes.c_int,
+        ctypes.c_void_p,
+    ]
+    recvmmsg.restype = ctypes.c_int
+    return sendmmsg, recvmmsg
+
+
+MMSG_FUNCTIONS = load_mmsg_functions()
+
+
+class DatagramIO:
+    """
+    This class implements batched datagram I/O with the portable socket API.
+    A batch costs one system call per datagram, but it is still handled under
+    a single acquisition of the RDT mutex.
+
+    It uses the following attributes:
+    sock: The socket used for sending and receiving data.
+    batch_size: The maximum number of datagrams in a batch.
+    """
+
+    def __init__(self, sock, batch_size=BATCH_SIZE):
+        """
+        This function initializes the batched I/O of a socket.
+        """
+        self.sock = sock
+        self.batch_size = batch_size
+
+    def recv(self, buffers):
+        """
+        This function receives a batch of datagrams into the given buffers. It
+        blocks until a datagram is received, then receives the datagrams that
+        are already waiting on the socket without blocking.
+
+        It returns a list of the size and the address of the received
+        datagrams, the i-th datagram is received into the i-th buffer.
+        """
+        received = [self.sock.recvfrom_into(buffers[0])]
+        for buffer in buffers[1 : self.batch_size]:
+            try:
+                received.append(self.recv_nowait(buffer))
+            except (BlockingIOError, InterruptedError):
+                break
+        return received
+
+    def recv_nowait(self, buffer):
+        """
+        This function receives a datagram that is already waiting on the
+        socket. It raises BlockingIOError if no datagram is waiting.
+        """
+        if hasattr(socket, "MSG_DONTWAIT"):
+            return self.sock.recvfrom_into(buffer, 0, socket.MSG_DONTWAIT)
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if not readable:
+            raise BlockingIOError(errno.EWOULDBLOCK, "no datagram is waiting")
+        return self.sock.recvfrom_into(buffer)
+
+    def send(self, datagrams):
+        """
+        This function sends a list of (message, address) datagrams in order.
+        A datagram larger than the path MTU is dropped, as the network would
+        drop it.
+        """
+        for message, address in datagrams:
+            try:
+                self.sock.sendto(message, address)
+            except OSError as error:
+                if error.errno != errno.EMSGSIZE:
+                    raise
+
+
+class MmsgDatagramIO(DatagramIO):
+    """
+    This class implements batched datagram I/O with the recvmmsg and sendmmsg
+    system calls of Linux. The message headers and the address buffers of a
+    batch are allocated once and reused. Sending and receiving run in
+    different threads, so each has its own message headers.
+
+    It uses the following attributes:
+    sendmmsg: The sendmmsg function of the C library.
+    recvmmsg: The recvmmsg function of the C library.
+    recv_messages: The array of message headers of a received batch.
+    recv_vectors: The array of I/O vectors of a received batch, one per message.
+    send_messages: The array of message headers of a sent batch.
+    send_vectors: The array of I/O vectors of a sent batch, one per message.
+    names: The buffer that the addresses of a received batch are written to.
+    sockaddrs: A dictionary of the C addresses of the socket addresses that are sent to.
+    addresses: A dictionary of the socket addresses of the C addresses that are received from.
+    """
+
+    def __init__(self, sock, batch_size=BATCH_SIZE):
+        """
+        This function allocates the message headers of a batch.
+        """
+        super().__init__(sock, batch_size)
+        self.sendmmsg, self.recvmmsg = MMSG_FUNCTIONS
+        self.recv_messages, self.recv_vectors = self.allocate_messages()
+        self.send_messages, self.send_vectors = self.allocate_messages()
+        self.names = ctypes.create_string_buffer(SOCKADDR_SIZE * batch_size)
+        self.sockaddrs = {}
+        self.addresses = {}
+
+    def allocate_messages(self):
+        """
+        This function allocates the message headers of a batch, every header
+        has a single I/O vector.
+        """
+        messages = (mmsghdr * self.batch_size)()
+        vectors = (iovec * self.batch_size)()
+        for i in range(self.batch_size):
+            header = messages[i].msg_hdr
+            header.msg_iov = ctypes.pointer(vectors[i])
+            header.msg_iovlen = 1
+        return messages, vectors
+
+    def recv(self, buffers):
+        """
+        This function receives a batch of datagrams into the given buffers
+        with a single recvmmsg call. It blocks until a datagram is received.
+
+        It returns a list of the size and the address of the received
+        datagrams, the i-th datagram is received into the i-th buffer.
+        """
+        count = min(len(buffers), self.batch_size)
+        names = ctypes.addressof(self.names)
+        # The ctypes arrays keep the buffers exported during the call.
+        arrays = []
+        for i in range(count):
+            array = (ctypes.c_char * len(buffers[i])).from_buffer(buffers[i])
+            arrays.append(array)
+            self.recv_vectors[i].iov_base = ctypes.addressof(array)
+            self.recv_vectors[i].iov_len = len(buffers[i])
+            header = self.recv_messages[i].msg_hdr
+            header.msg_name = names + i * SOCKADDR_SIZE
+            header.msg_namelen = SOCKADDR_SIZE
+
+        while True:
+            received = self.recvmmsg(
+                self.sock.fileno(), self.recv_messages, count, MSG_WAITFORONE, None
+            )
+            if received >= 0:
+                break
+            self.handle_error(ctypes.get_errno(), is_recv=True)
+
+        return [
+            (
+                self.recv_messages[i].msg_len,
+                self.decode_address(
+                    self.names[
+                        i * SOCKADDR_SIZE : i * SOCKADDR_SIZE
+                        + self.recv_messages[i].msg_hdr.msg_namelen
+                    ]
+                ),
+            )
+            for i in range(received)
+        ]
+
+    def send(self, datagrams):
+        """
+        This function sends a list of (message, address) datagrams in order,
+        with a sendmmsg call per batch. A datagram larger than the path MTU is
+        dropped, as the network would drop it.
+        """
+        start = 0
+        while start < len(datagrams):
+            batch = datagrams[start : start + self.batch_size]
+            # The C pointers refer to the bytes objects kept by batch and by
+            # the address cache.
+            for i, (message, address) in enumerate(batch):
+                if not isinstance(message, bytes):
+                    message = bytes(message)
+                    batch[i] = (message, address)
+                sockaddr = self.encode_address(address)
+                self.send_vectors[i].iov_base = ctypes.cast(
+                    ctypes.c_char_p(message), ctypes.c_void_p
+                ).value
+                self.send_vectors[i].iov_len = len(message)
+                header = self.send_messages[i].msg_hdr
+                header.msg_name = ctypes.cast(
+                    ctypes.c_char_p(sockaddr), ctypes.c_void_p
+                ).value
+                header.msg_namelen = len(sockaddr)
+
+            sent = self.sendmmsg(self.sock.fileno(), self.send_messages, len(batch), 0)
+            if sent < 0:
+                error = ctypes.get_errno()
+                if error == errno.EMSGSIZE:
+                    start += 1
+                    continue
+                self.handle_error(error, is_recv=False)
+                continue
+            start += sent
+
+    def handle_error(self, error, is_recv):
+        """
+        This function handles the error of a recvmmsg or sendmmsg call. The
+        call is retried after an interrupt, and after the socket is ready if
+        the socket is non-blocking. Other errors are raised as OSError.
+        """
+        if error == errno.EINTR:
+            return
+        if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+            if is_recv:
+                ready = select.select([self.sock], [], [], self.sock.gettimeout())[0]
+            else:
+                ready = select.select([], [self.sock], [], self.sock.gettimeout())[1]
+            if not ready:
+                raise socket.timeout("timed out")
+            return
+        raise OSError(error, os.strerror(error))
+
+    def encode_address(self, address):
+        """
+        This function returns the C address of a socket address. Host names
+        are resolved as sendto would resolve them.
+        """
+        sockaddr = self.sockaddrs.get(address)
+        if sockaddr is not None:
+            return sockaddr
+
+        host, port = address[0], address[1]
+        if self.sock.family == socket.AF_INET:
+            try:
+                packed_host = socket.inet_pton(socket.AF_INET, host)
+            except OSError:
+                host = socket.getaddrinfo(host, port, socket.AF_INET)[0][4][0]
+                packed_host = socket.inet_pton(socket.AF_INET, host)
+            sockaddr = SOCKADDR_FAMILY.pack(socket.AF_INET) + SOCKADDR_IN.pack(
+                port, packed_host
+            )
+        else:
+            flowinfo = address[2] if len(address) > 2 else 0
+            scope_id = address[3] if len(address) > 3 else 0
+            try:
+                packed_host = socket.inet_pton(socket.AF_INET6, host)
+            except OSError:
+                host = socket.getaddrinfo(host, port, socket.AF_INET6)[0][4][0]
+                packed_host = socket.inet_pton(socket.AF_INET6, host)
+            sockaddr = (
+                SOCKADDR_FAMILY.pack(socket.AF_INET6)
+                + SOCKADDR_IN6.pack(port, flowinfo, packed_host)
+                + SCOPE_ID.pack(scope_id)
+            )
+
+        if len(self.sockaddrs) >= MAX_CACHED_ADDRESSES:
+            self.sockaddrs.clear()
+        self.sockaddrs[address] = sockaddr
+        return sockaddr
+
+    def decode_address(self, sockaddr):
+        """
+        This function returns the socket address of a C address, in the form
+        that recvfrom returns it.
+        """
+        address = self.addresses.get(sockaddr)
+        if address is not None:
+            return address
+
+        (family,) = SOCKADDR_FAMILY.unpack_from(sockaddr)
+        if family == socket.AF_INET:
+            port, packed_host = SOCKADDR_IN.unpack_from(sockaddr, SOCKADDR_FAMILY.size)
+            address = (socket.inet_ntop(socket.AF_INET, packed_host), port)
+        else:
+            port, flowinfo, packed_host = SOCKADDR_IN6.unpack_from(
+                sockaddr, SOCKADDR_FAMILY.size
+            )
+            (scope_id,) = SCOPE_ID.unpack_from(
+                sockaddr, SOCKADDR_FAMILY.size + SOCKADDR_IN6.size
+            )
+            address = (
+                socket.inet_ntop(socket.AF_INET6, packed_host),
+                port,
+                flowinfo,
+                scope_id,
+            )
+
+        if len(self.addresses) >= MAX_CACHED_ADDRESSES:
+            self.addresses.clear()
+        self.addresses[sockaddr] = address
+        return address
+
+
+def create_datagram_io(sock, batch_size=BATCH_SIZE):
+    """
+    This function creates the batched I/O of a socket. It uses recvmmsg and
+    sendmmsg when the platform has them and the socket is an IPv4 or IPv6
+    socket, and the portable socket API otherwise.
+    """
+    if MMSG_FUNCTIONS is not None and sock.family in (
+        socket.AF_INET,
+        socket.AF_INET6,
+    ):
+        return MmsgDatagramIO(sock, batch_size)
+    return DatagramIO(sock, batch_size)
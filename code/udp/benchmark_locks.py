@@ -0,0 +1,190 @@
+"""
+This is a benchmark of the lock contention between the application, the
+sending thread and the receiving thread of RDT.
+
+A client sends many small messages in large batches with send_many to a server
+on the loopback interface, while its receiving thread handles the acks of the
+server. The send buffer of the client holds two batches and every batch is
+sent when the send buffer is writable, so it is queued at once, in a single
+call of send_many, while the previous batch is in flight. Before every batch
+of acks, the receiving thread measures how long it waits for the mutex of the
+connection, which shows how long the acks are held up by the application while
+it enqueues its batches. The time taken to handle the batch also includes the
+verification of the acks and the waits for the interpreter lock.
+
+The transfer runs twice: first as a baseline that holds the mutex while every
+batch is queued, as when a single mutex guarded the send buffer and the state
+of the protocol, then with the split locks, where send_many holds only the
+lock of the send buffer. A batch takes longer to queue than the interval at
+which the interpreter switches threads, so the baseline holds up the acks
+for the whole batch, while the split locks let them in at the next switch.
+
+Usage: python3 benchmark_locks.py [--messages N] [--batch N] [--size N]
+"""
+
+
+import argparse
+import socket
+import statistics
+import threading
+import time
+from listener import RDTListener
+from rdt import RDT
+
+
+def percentile(samples, fraction):
+    """
+    This function returns the sample below which the fraction of the sorted
+    samples lies.
+    """
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def send_batch(client, msgs, address, is_baseline):
+    """
+    This function queues a batch of messages as the send buffer is writable
+    and returns the time spent in send_many. The baseline holds the mutex of
+    the connection while the messages are queued.
+    """
+    elapsed = 0
+    queued = 0
+    while queued < len(msgs):
+        while not client.is_writable():
+            time.sleep(0.001)
+        start = time.perf_counter()
+        try:
+            if is_baseline:
+                with client.mutex:
+                    queued += client.send_many(msgs[queued:], address, block=False)
+            else:
+                queued += client.send_many(msgs[queued:], address, block=False)
+        except BlockingIOError:
+            pass
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def run(args, is_baseline):
+    """
+    This function runs a transfer and returns the elapsed time, the times
+    spent in send_many, and the sorted times that the receiving thread waited
+    for the mutex and took to handle the batches of acks.
+    """
+    server_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_sock.bind(("127.0.0.1", 0))
+    server_address = server_sock.getsockname()
+    listener = RDTListener(server_sock)
+
+    client_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client = RDT(client_sock, False, server_address)
+    client.initialize_connection()
+    client.send_buffer_size = 2 * args.batch * args.size
+    connection = listener.accept()
+
+    # The receiving thread looks up handle_messages on every batch, so the
+    # wrapper times the batches of the client alone.
+    wait_times = []
+    handle_times = []
+    handle_messages = client.handle_messages
+
+    def timed_handle_messages(received):
+        start = time.perf_counter()
+        client.mutex.acquire()
+        wait_times.append(time.perf_counter() - start)
+        client.mutex.release()
+        is_kept = handle_messages(received)
+        handle_times.append(time.perf_counter() - start)
+        return is_kept
+
+    client.handle_messages = timed_handle_messages
+
+    def receive():
+        for _ in range(args.messages):
+            message, _ = connection.recv_view()
+            connection.release_view(message)
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+
+    message = bytes(args.size)
+    batch = [message] * args.batch
+    send_times = []
+    start = time.perf_counter()
+    for offset in range(0, args.messages, args.batch):
+        msgs = batch[: min(args.batch, args.messages - offset)]
+        send_times.append(send_batch(client, msgs, server_address, is_baseline))
+    receiver.join()
+    elapsed = time.perf_counter() - start
+
+    client.close()
+    connection.shutdown()
+
+    wait_times.sort()
+    handle_times.sort()
+    return elapsed, send_times, wait_times, handle_times
+
+
+def summarize(args, elapsed, send_times, wait_times, handle_times):
+    """
+    This function returns the rows of (label, value) of a transfer: the
+    throughput, the time spent in send_many and the time taken to handle the
+    batches of acks.
+    """
+    rows = [
+        ("throughput", f"{args.messages * args.size / elapsed / 1e6:.2f} MB/s"),
+        ("send_many batches", f"{len(send_times)}"),
+        ("send_many mean", f"{statistics.mean(send_times) * 1e3:.2f} ms"),
+        ("send_many max", f"{max(send_times) * 1e3:.2f} ms"),
+        ("ack batches", f"{len(handle_times)}"),
+    ]
+    for label, samples in (("mutex wait", wait_times), ("handling", handle_times)):
+        rows += [
+            (f"{label} p50", f"{percentile(samples, 0.5) * 1e6:.0f} us"),
+            (f"{label} p99", f"{percentile(samples, 0.99) * 1e6:.0f} us"),
+            (f"{label} max", f"{samples[-1] * 1e6:.0f} us"),
+            (f"{label} total", f"{sum(samples) * 1e3:.1f} ms"),
+        ]
+    return rows
+
+
+def report(names, results):
+    """
+    This function prints the rows of the transfers side by side, a column
+    per transfer.
+    """
+    labels = [label for label, _ in results[0]]
+    columns = [[value for _, value in rows] for rows in results]
+    label_width = max(map(len, labels))
+    widths = [max(len(name), *map(len, column)) for name, column in zip(names, columns)]
+    print(
+        " " * label_width
+        + "".join(f"  {name:>{width}}" for name, width in zip(names, widths))
+    )
+    for index, label in enumerate(labels):
+        print(
+            f"{label:<{label_width}}"
+            + "".join(
+                f"  {column[index]:>{width}}" for column, width in zip(columns, widths)
+            )
+        )
+
+
+def main():
+    """
+    This is the main function of the benchmark. It runs the transfer with the
+    baseline and with the split locks and prints them side by side.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--messages", type=int, default=600000)
+    parser.add_argument("--batch", type=int, default=100000)
+    parser.add_argument("--size", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"messages: {args.messages} of {args.size} bytes in batches of {args.batch}")
+    baseline = summarize(args, *run(args, True))
+    split = summarize(args, *run(args, False))
+    report(["single mutex (baseline)", "split locks"], [baseline, split])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+buffer_pool implements a pool of preallocated receive buffers. RDT receives
+every datagram into a buffer of the pool with recvfrom_into, so datagrams are
+not copied into new bytes objects and the buffers are reused.
+"""
+
+
+from collections import deque
+
+MAX_FREE_BUFFERS = 2048
+
+
+class BufferPool:
+    """
+    This class implements a pool of bytearrays of the same size. A buffer is
+    taken from the pool with acquire and given back with release, the pool
+    allocates a new buffer when no free buffer is left.
+
+    The free buffers are kept in a deque, acquire and release may be called
+    from different threads.
+
+    It uses the following attributes:
+    buffer_size: The size of the buffers.
+    max_free: The maximum number of free buffers kept by the pool.
+    free: A deque of the free buffers.
+    """
+
+    def __init__(self, buffer_size, max_free=MAX_FREE_BUFFERS):
+        """
+        This function initializes the pool without any buffer.
+        """
+        self.buffer_size = buffer_size
+        self.max_free = max_free
+        self.free = deque()
+
+    def acquire(self):
+        """
+        This function returns a free buffer.
+        """
+        try:
+            return self.free.pop()
+        except IndexError:
+            return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        """
+        This function gives a buffer back to the pool. The buffer must not be
+        used after it is released. Buffers that are not from the pool, such as
+        decompressed payloads, are dropped.
+        """
+        if (
+            isinstance(buffer, bytearray)
+            and len(buffer) == self.buffer_size
+            and len(self.free) < self.max_free
+        ):
+            self.free.append(buffer)
@@ -0,0 +1,89 @@
+"""
+checksum implements the integrity checks that RDT uses to detect corrupted
+segments. CRC32 and Adler-32 are cheap and catch the corruption of a link,
+MD5 and BLAKE2 are kept as opt-in strong checks.
+"""
+
+
+import hashlib
+import struct
+import zlib
+
+CHECKSUM_32 = struct.Struct("!I")
+
+
+class Checksum:
+    """
+    This class describes an integrity check.
+
+    It uses the following attributes:
+    name: The name of the check.
+    code: The number that identifies the check in the segment header.
+    size: The size of the checksum in bytes.
+    function: The function that computes the checksum of a header and a payload.
+    """
+
+    def __init__(self, name, code, size, function):
+        """
+        This function initializes the integrity check.
+        """
+        self.name = name
+        self.code = code
+        self.size = size
+        self.function = function
+
+    def compute(self, header, payload):
+        """
+        This function returns the checksum of a header and a payload.
+        """
+        return self.function(header, payload)
+
+
+def crc32(header, payload):
+    """
+    This function returns the CRC32 of a header and a payload.
+    """
+    return CHECKSUM_32.pack(zlib.crc32(payload, zlib.crc32(header)))
+
+
+def adler32(header, payload):
+    """
+    This function returns the Adler-32 of a header and a payload.
+    """
+    return CHECKSUM_32.pack(zlib.adler32(payload, zlib.adler32(header)))
+
+
+def md5(header, payload):
+    """
+    This function returns the MD5 digest of a header and a payload.
+    """
+    hash_function = hashlib.md5(header)
+    hash_function.update(payload)
+    return hash_function.digest()
+
+
+def blake2(header, payload):
+    """
+    This function returns the 16 bytes BLAKE2b digest of a header and a payload.
+    """
+    hash_function = hashlib.blake2b(header, digest_size=16)
+    hash_function.update(payload)
+    return hash_function.digest()
+
+
+CHECKSUMS = {
+    "crc32": Checksum("crc32", 1, 4, crc32),
+    "adler32": Checksum("adler32", 2, 4, adler32),
+    "md5": Checksum("md5", 3, 16, md5),
+    "blake2": Checksum("blake2", 4, 16, blake2),
+}
+CHECKSUMS_BY_CODE = {checksum.code: checksum for checksum in CHECKSUMS.values()}
+
+
+def get_checksum(name):
+    """
+    This function returns the integrity check with the given name.
+    """
+    if name not in CHECKSUMS:
+        raise ValueError(f"unknown checksum: {name}")
+    return CHECKSUMS[name]
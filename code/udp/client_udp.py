@@ -18,7 +18,6 @@ C -> closes
 
 import socket
 from rdt_plus import RDTPlus
-import ast
 import hashlib
 
 # setting up the scokcet
@@ -50,9 +49,8 @@ def main():
         This loop receives the files from the server.
         """
         msg, address = client_rdt.recv()
-        msg = msg.decode("utf-8")
-        headers, file = msg.split("\n\n")
-        file = ast.literal_eval(file)
+        headers, file = msg.split(b"\n\n", 1)
+        headers = headers.decode("utf-8")
         size = int(headers.split("\n")[0].split(":")[1])
         checksum = headers.split("\n")[1].split(":")[1]
         hash_function = hashlib.md5()
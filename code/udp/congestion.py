@@ -0,0 +1,225 @@
+"""
+congestion implements the congestion control algorithms of RDT. A congestion
+controller owns the congestion window of a connection, RDT calls it when
+messages are acked, when a loss is inferred and when a timer expires.
+"""
+
+
+import time
+from abc import ABC, abstractmethod
+
+INITIAL_WINDOW = 10
+MIN_WINDOW = 2
+INITIAL_SLOW_START_THRESHOLD = float("inf")
+
+RENO_BETA = 0.5
+
+CUBIC_BETA = 0.7
+CUBIC_C = 0.4
+
+
+class CongestionController(ABC):
+    """
+    This class is the interface of the congestion controllers. The window is
+    counted in segments and starts with slow start, the subclasses decide how
+    the window grows in congestion avoidance and shrinks after a loss. A
+    subclass that does not implement both can not be created.
+
+    It uses the following attributes:
+    max_window: The upper bound of the congestion window.
+    cwnd: The congestion window.
+    ssthresh: The slow start threshold.
+    """
+
+    def __init__(self, max_window):
+        """
+        This function initializes the congestion window and the slow start
+        threshold.
+        """
+        self.max_window = max_window
+        self.cwnd = min(INITIAL_WINDOW, max_window)
+        self.ssthresh = INITIAL_SLOW_START_THRESHOLD
+
+    def window(self):
+        """
+        This function returns the number of segments that may be in flight.
+        """
+        return max(int(self.cwnd), 1)
+
+    def in_slow_start(self):
+        """
+        This function returns whether the window is below the slow start threshold.
+        """
+        return self.cwnd < self.ssthresh
+
+    def on_ack(self, acked, rtt):
+        """
+        This function is called when an ack retires acked messages. rtt is the
+        smoothed round trip time, or None if it is not measured yet.
+
+        In slow start the window grows by one segment per acked segment, the
+        rest of the growth is left to congestion_avoidance.
+        """
+        if self.in_slow_start():
+            grow = min(acked, self.ssthresh - self.cwnd)
+            self.cwnd += grow
+            acked -= grow
+        if acked > 0:
+            self.congestion_avoidance(acked, rtt)
+        self.cwnd = min(self.cwnd, self.max_window)
+
+    @abstractmethod
+    def congestion_avoidance(self, acked, rtt):
+        """
+        This function grows the window above the slow start threshold.
+        """
+
+    @abstractmethod
+    def on_loss(self):
+        """
+        This function is called once per window in which a loss is inferred
+        from the acks.
+        """
+
+    def on_timeout(self):
+        """
+        This function is called when the retransmission timer expires. The
+        window collapses to one segment and slow start begins again.
+        """
+        self.on_loss()
+        self.cwnd = 1
+
+
+class Reno(CongestionController):
+    """
+    This class implements the additive increase, multiplicative decrease
+    window of TCP Reno (RFC 5681).
+    """
+
+    def congestion_avoidance(self, acked, rtt):
+        """
+        This function grows the window by one segment per round trip time.
+        """
+        self.cwnd += acked / self.cwnd
+
+    def on_loss(self):
+        """
+        This function halves the window.
+        """
+        self.ssthresh = max(self.cwnd * RENO_BETA, MIN_WINDOW)
+        self.cwnd = self.ssthresh
+
+
+class Cubic(CongestionController):
+    """
+    This class implements CUBIC (RFC 8312). After a loss the window grows as a
+    cubic function of the time since the loss, centered on the window at which
+    the loss happened.
+
+    It uses the following attributes:
+    w_max: The window before the last reduction.
+    epoch_start: The time at which the current congestion avoidance epoch started.
+    k: The time the cubic function takes to reach w_max.
+    w_est: The window that TCP Reno would have in the same epoch.
+    """
+
+    def __init__(self, max_window):
+        """
+        This function initializes the CUBIC state.
+        """
+        super().__init__(max_window)
+        self.w_max = 0
+        self.epoch_start = None
+        self.k = 0
+        self.w_est = 0
+
+    def congestion_avoidance(self, acked, rtt):
+        """
+        This function grows the window toward the cubic target one round trip
+        time ahead. The window never grows slower than TCP Reno would.
+        """
+        now = time.monotonic()
+        rtt = rtt or 0
+        if self.epoch_start is None:
+            self.epoch_start = now
+            if self.cwnd < self.w_max:
+                self.k = ((self.w_max - self.cwnd) / CUBIC_C) ** (1 / 3)
+            else:
+                self.k = 0
+                self.w_max = self.cwnd
+            self.w_est = self.cwnd
+
+        t = now - self.epoch_start + rtt
+        target = CUBIC_C * (t - self.k) ** 3 + self.w_max
+        if target > self.cwnd:
+            self.cwnd += (target - self.cwnd) / self.cwnd * acked
+        else:
+            self.cwnd += 0.01 / self.cwnd * acked
+
+        self.w_est += 3 * (1 - CUBIC_BETA) / (1 + CUBIC_BETA) * acked / self.cwnd
+        self.cwnd = max(self.cwnd, self.w_est)
+
+    def on_loss(self):
+        """
+        This function reduces the window by CUBIC_BETA and starts a new epoch.
+        If the loss happens before the last w_max is reached, w_max is lowered
+        to leave bandwidth to other flows (fast convergence).
+        """
+        if self.cwnd < self.w_max:
+            self.w_max = self.cwnd * (1 + CUBIC_BETA) / 2
+        else:
+            self.w_max = self.cwnd
+        self.epoch_start = None
+        self.ssthresh = max(self.cwnd * CUBIC_BETA, MIN_WINDOW)
+        self.cwnd = self.ssthresh
+
+
+class FixedWindow(CongestionController):
+    """
+    This class keeps the window at its upper bound whatever happens on the
+    path. It is the behaviour of RDT without congestion control and is kept
+    to compare the algorithms against it.
+    """
+
+    def __init__(self, max_window):
+        """
+        This function opens the window to its upper bound.
+        """
+        super().__init__(max_window)
+        self.cwnd = max_window
+
+    def on_ack(self, acked, rtt):
+        """
+        This function keeps the window.
+        """
+
+    def congestion_avoidance(self, acked, rtt):
+        """
+        This function keeps the window.
+        """
+
+    def on_loss(self):
+        """
+        This function keeps the window.
+        """
+
+    def on_timeout(self):
+        """
+        This function keeps the window.
+        """
+
+
+CONGESTION_CONTROLLERS = {
+    "reno": Reno,
+    "cubic": Cubic,
+    "fixed": FixedWindow,
+}
+
+
+def create_congestion_controller(name, max_window):
+    """
+    This function creates the congestion controller with the given name.
+    """
+    if name not in CONGESTION_CONTROLLERS:
+        raise ValueError(f"unknown congestion control algorithm: {name}")
+    return CONGESTION_CONTROLLERS[name](max_window)
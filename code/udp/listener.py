@@ -0,0 +1,345 @@
+"""
+listener implements a server that serves many RDT clients on one socket. The
+listener receives every datagram of the socket and demultiplexes it by its
+connection ID to an RDTConnection that holds the state of that peer alone: its
+windows, timers and buffers. Initial messages carry no connection ID yet, they
+are demultiplexed by the address of the peer. New connections are handed to
+the upper layer with accept.
+"""
+
+
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from buffer_pool import BufferPool
+from batch_io import create_datagram_io
+from rdt import (
+    RDT,
+    HEADER,
+    BUFFER_SIZE,
+    CONGESTION_CONTROL,
+    CHECKSUM,
+    FEATURES,
+    PACING,
+)
+
+# A closed connection is kept for LINGER_TIME seconds after its close is acked,
+# so a retransmitted close message is acked again.
+LINGER_TIME = 5.0
+# The interval at which the listener looks for closed connections to remove.
+REAP_INTERVAL = 1.0
+# A connection whose peer sends nothing for IDLE_TIMEOUT seconds is aborted, a
+# crashed peer that has no data in flight is never found by the retransmissions.
+IDLE_TIMEOUT = 300.0
+
+
+class RDTConnection(RDT):
+    """
+    This class implements the server end of a connection of a listener. It is
+    a server RDT whose messages are received by the listener, it has its own
+    sending thread and timers and sends on the socket of the listener.
+
+    The connection follows its peer to a new address, so it survives a NAT
+    rebinding or a client that changes its network.
+
+    It uses the following attributes in addition to the attributes of RDT:
+    listener: The listener that the connection belongs to.
+    assigned_connection_id: The connection ID assigned by the listener.
+    close_time: The time at which the close message was acked or the connection was aborted, or None.
+    last_receive_time: The time at which the last message of the peer was received.
+    """
+
+    def __init__(self, listener, address, connection_id):
+        """
+        This function initializes the connection with the peer at address. The
+        connection ID is given to the peer in the handshake.
+        """
+        self.listener = listener
+        self.assigned_connection_id = connection_id
+        self.close_time = None
+        self.last_receive_time = time.monotonic()
+        super().__init__(
+            listener.sock,
+            True,
+            address,
+            listener.congestion_control,
+            listener.checksum_name,
+            listener.features,
+            listener.pacing,
+        )
+
+    def start(self):
+        """
+        This function shares the buffer pool of the listener and starts the
+        connection without a receiving thread.
+        """
+        self.buffer_pool = self.listener.buffer_pool
+        super().start()
+
+    def start_threads(self):
+        """
+        This function starts the sending thread. The listener receives the
+        messages of the connection.
+        """
+        self.sending_thread = threading.Thread(target=self.sending_thread_func)
+        self.receiving_thread = None
+        self.sending_thread.start()
+
+    def new_connection_id(self):
+        """
+        This function returns the connection ID assigned by the listener.
+        """
+        return self.assigned_connection_id
+
+    def message_handler(self, type, connection_id, id, length, data, client_address):
+        """
+        This function handles a verified message of the connection. A message
+        of the connection from a new address moves the connection to it.
+        """
+        self.last_receive_time = time.monotonic()
+        if (
+            type != "i"
+            and self.is_connected
+            and connection_id == self.connection_id
+            and client_address != self.address
+        ):
+            self.address = client_address
+        return super().message_handler(
+            type, connection_id, id, length, data, client_address
+        )
+
+    def send_close_ack(self):
+        """
+        This function acks the close message and records the time at which
+        the connection is closed. No data follows the close message, so the
+        upper layer reads what is left and is told that the connection is
+        closed.
+        """
+        super().send_close_ack()
+        if self.close_time is None:
+            self.exit_flag = True
+            self.sending_condition.notify()
+            with self.recv_lock:
+                self.recv_condition.notify_all()
+        self.close_time = time.monotonic()
+
+    def abort(self):
+        """
+        This function aborts the connection and records the time at which it
+        is closed, so the listener removes it after LINGER_TIME seconds.
+        """
+        super().abort()
+        if self.close_time is None:
+            self.close_time = time.monotonic()
+
+    def shutdown(self):
+        """
+        This function stops the sending thread and the timers of the connection
+        and wakes up the upper layer if it is waiting for data or for room in
+        the send buffer.
+        """
+        with self.mutex:
+            self.exit_flag = True
+            self.sending_condition.notify()
+        with self.send_buffer_lock:
+            self.close_flag = True
+            self.writable_condition.notify_all()
+        with self.recv_lock:
+            self.recv_condition.notify_all()
+        self.timers.stop()
+
+
+class RDTListener:
+    """
+    This class implements a server that accepts many RDT connections on one
+    socket. A receiving thread receives the datagrams in batches and hands the
+    datagrams of every connection ID to its connection. An initial message from
+    an unknown peer creates a new connection that is returned by accept.
+
+    It uses the following attributes:
+    sock: The socket used for sending and receiving data.
+    io: The batched I/O of the socket.
+    congestion_control: The name of the congestion control algorithm of the connections.
+    checksum_name: The name of the preferred checksum of the connections.
+    features: The bitmask of the features offered to the clients.
+    pacing: The pacing of the connections.
+    buffer_pool: The pool of the buffers that datagrams are received into.
+    connections: A dictionary of the connections by their connection ID.
+    peers: A dictionary of the connections by the address of the initial message of their peer.
+    idle_timeout: The number of seconds after which a connection whose peer sends nothing is aborted.
+    accept_queue: A queue of the new connections not yet accepted.
+    mutex: A mutex used for synchronization.
+    accept_condition: A condition variable used to wait for new connections.
+    receiving_thread: A thread used for receiving data.
+    """
+
+    def __init__(
+        self,
+        sock,
+        congestion_control=CONGESTION_CONTROL,
+        checksum=CHECKSUM,
+        features=FEATURES,
+        pacing=PACING,
+    ):
+        """
+        This function initializes the listener and starts its receiving
+        thread. The socket must be bound, its timeout is set to REAP_INTERVAL
+        so closed connections are removed when no datagram is received.
+        """
+        self.sock = sock
+        self.sock.settimeout(REAP_INTERVAL)
+        self.io = create_datagram_io(sock)
+        self.congestion_control = congestion_control
+        self.checksum_name = checksum
+        self.features = features
+        self.pacing = pacing
+        self.buffer_pool = BufferPool(BUFFER_SIZE)
+        self.connections = {}
+        self.peers = {}
+        self.idle_timeout = IDLE_TIMEOUT
+        self.accept_queue = deque()
+        self.mutex = threading.Lock()
+        self.accept_condition = threading.Condition(self.mutex)
+        self.receiving_thread = threading.Thread(
+            target=self.receiving_thread_func, daemon=True
+        )
+        self.receiving_thread.start()
+
+    def accept(self):
+        """
+        This function is called by the upper layer to wait for a new connection.
+        It returns the connection.
+        """
+        with self.mutex:
+            while len(self.accept_queue) == 0:
+                self.accept_condition.wait()
+            return self.accept_queue.popleft()
+
+    def receiving_thread_func(self):
+        """
+        This function is the target of the receiving thread. It receives the
+        datagrams in batches and demultiplexes them by their connection ID, or
+        by the address of the peer for the initial messages. The datagrams of a
+        connection are handled as a batch by the connection.
+
+        A buffer is reused for the next batch unless its message is data that
+        waits for the upper layer. The thread serves the listener for the
+        lifetime of the process.
+        """
+        buffers = []
+        while True:
+            while len(buffers) < self.io.batch_size:
+                buffers.append(self.buffer_pool.acquire())
+            try:
+                received = self.io.recv(buffers)
+            except socket.timeout:
+                received = []
+
+            batches = {}
+            for index, ((nbytes, address), buffer) in enumerate(zip(received, buffers)):
+                message = memoryview(buffer)[:nbytes]
+                connection = self.route(message, address)
+                if connection is not None:
+                    batches.setdefault(connection, []).append((index, message, address))
+
+            is_kept = [False] * len(received)
+            for connection, batch in batches.items():
+                kept = connection.handle_messages(
+                    [(message, address) for _, message, address in batch]
+                )
+                for (index, _, _), is_message_kept in zip(batch, kept):
+                    is_kept[index] = is_message_kept
+
+            buffers = [
+                buffer for buffer, kept in zip(buffers, is_kept) if not kept
+            ] + buffers[len(received) :]
+            self.reap()
+
+    def route(self, message, address):
+        """
+        This function returns the connection that a datagram belongs to, by
+        its connection ID, or by the address of the peer for an initial
+        message. A valid initial message from an unknown peer creates a new
+        connection. It returns None if the datagram belongs to no connection.
+
+        A peer that restarts on the same address sends an initial message with
+        a new sequence number. Its connection is shut down and replaced by a
+        new one, the state of the old session is not reused.
+        """
+        try:
+            _, type, _, connection_id, id, _ = HEADER.unpack_from(message)
+        except struct.error:
+            return None
+        if connection_id != 0:
+            return self.connections.get(connection_id)
+        if chr(type) != "i":
+            return None
+        connection = self.peers.get(address)
+        # A closed connection is replaced if the peer connects again, a live
+        # one if the initial message is not a retransmission of its own.
+        if (
+            connection is None
+            or connection.close_time is not None
+            or connection.init_id not in (None, id)
+        ):
+            new_connection = self.new_connection(message, address)
+            if new_connection is not None:
+                if connection is not None:
+                    self.connections.pop(connection.assigned_connection_id, None)
+                    connection.shutdown()
+                connection = new_connection
+        return connection
+
+    def new_connection(self, message, address):
+        """
+        This function creates the connection of a peer that sends a valid
+        initial message and queues it to be accepted. It returns the
+        connection, or None.
+        """
+        connection_id = random.randrange(1, 1 << 32)
+        while connection_id in self.connections:
+            connection_id = random.randrange(1, 1 << 32)
+        connection = self.create_connection(address, connection_id)
+        if connection.verify_message(message) is None:
+            connection.shutdown()
+            return None
+        self.connections[connection_id] = connection
+        self.peers[address] = connection
+        with self.mutex:
+            self.accept_queue.append(connection)
+            self.accept_condition.notify()
+        return connection
+
+    def create_connection(self, address, connection_id):
+        """
+        This function creates the connection of the peer at address with the
+        connection ID assigned to it.
+        """
+        return RDTConnection(self, address, connection_id)
+
+    def reap(self):
+        """
+        This function removes and shuts down the connections that are closed
+        for more than LINGER_TIME seconds. It aborts the connections whose peer
+        sent nothing for idle_timeout seconds, they are removed in turn.
+        """
+        now = time.monotonic()
+        for connection_id, connection in list(self.connections.items()):
+            if (
+                connection.close_time is None
+                and now - connection.last_receive_time > self.idle_timeout
+            ):
+                with connection.mutex:
+                    connection.abort()
+            if (
+                connection.close_time is not None
+                and now - connection.close_time > LINGER_TIME
+            ):
+                del self.connections[connection_id]
+                connection.shutdown()
+        for address, connection in list(self.peers.items()):
+            if connection.assigned_connection_id not in self.connections:
+                del self.peers[address]
@@ -0,0 +1,103 @@
+"""
+pacing implements a token bucket that spreads the segments of RDT over time at
+a target rate instead of sending a window of segments back to back. Bursts
+overflow the queues of the NICs and switches on the path and cause losses that
+end in timeouts.
+"""
+
+
+import time
+
+
+class TokenBucket:
+    """
+    This class implements a token bucket rate limiter. Tokens are bytes, they
+    accumulate at the rate up to the burst size and every sent datagram takes
+    its size from the bucket. A datagram may be sent while the bucket is not
+    empty, so the bucket goes into debt for a large datagram and the next
+    datagram waits until the debt is paid back.
+
+    It uses the following attributes:
+    rate: The rate in bytes per second, or None if the datagrams are not paced.
+    burst: The largest number of tokens that the bucket holds.
+    tokens: The number of tokens in the bucket, negative while in debt.
+    last_time: The time at which the tokens were last refilled.
+    wait_start: The time at which the sender started to wait, or None.
+    sent_bytes: The number of bytes sent through the bucket.
+    sent_datagrams: The number of datagrams sent through the bucket.
+    delays: The number of times the sender waited for tokens.
+    delay_time: The total time that the sender waited for tokens.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        This function initializes a full bucket with the rate and the burst size.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_time = time.monotonic()
+        self.wait_start = None
+        self.sent_bytes = 0
+        self.sent_datagrams = 0
+        self.delays = 0
+        self.delay_time = 0.0
+
+    def refill(self, now):
+        """
+        This function adds the tokens accumulated since the last refill.
+        """
+        if self.rate is not None:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.last_time) * self.rate
+            )
+        else:
+            self.tokens = self.burst
+        self.last_time = now
+
+    def set_rate(self, rate, now):
+        """
+        This function changes the rate. The tokens accumulated at the previous
+        rate are kept.
+        """
+        self.refill(now)
+        self.rate = rate
+
+    def delay(self, now):
+        """
+        This function returns the time until the next datagram may be sent, 0
+        if it may be sent now.
+        """
+        self.refill(now)
+        if self.tokens > 0:
+            return 0
+        if self.wait_start is None:
+            self.wait_start = now
+            self.delays += 1
+        return -self.tokens / self.rate
+
+    def consume(self, size, now):
+        """
+        This function takes the size of a sent datagram from the bucket.
+        """
+        self.refill(now)
+        self.tokens -= size
+        self.sent_bytes += size
+        self.sent_datagrams += 1
+        if self.wait_start is not None:
+            self.delay_time += now - self.wait_start
+            self.wait_start = None
+
+    def stats(self):
+        """
+        This function returns the rate, the tokens and the counters of the
+        bucket.
+        """
+        return {
+            "rate": self.rate,
+            "tokens": self.tokens,
+            "sent_bytes": self.sent_bytes,
+            "sent_datagrams": self.sent_datagrams,
+            "delays": self.delays,
+            "delay_time": self.delay_time,
+        }
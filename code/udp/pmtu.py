@@ -0,0 +1,115 @@
+"""
+pmtu implements packetization layer path MTU discovery (RFC 8899) for RDT. The
+socket sets the don't fragment bit, so a datagram larger than the path MTU is
+dropped instead of being fragmented, and RDT searches the largest datagram that
+reaches the other end with probes. The segments are sized to fit it, so a lost
+IP fragment never loses a whole segment.
+"""
+
+
+import socket
+import sys
+
+# The datagram size that every path is assumed to carry (BASE_PLPMTU of RFC
+# 8899). It is used until the search finds a larger size, and for good if the
+# don't fragment bit can not be set.
+BASE_DATAGRAM_SIZE = 1200
+# The number of probes of a size that are lost before the size is given up.
+MAX_PROBES = 3
+# The search ends when the largest acked size and the smallest lost size are
+# this close.
+SEARCH_GRANULARITY = 16
+
+# The socket options of Linux that set the don't fragment bit without using
+# the path MTU known by the kernel. They are not exported by the socket module.
+IP_MTU_DISCOVER = 10
+IPV6_MTU_DISCOVER = 23
+PMTUDISC_PROBE = 3
+
+
+def set_dont_fragment(sock):
+    """
+    This function sets the don't fragment bit on the datagrams of the socket.
+    It returns whether the bit is set, the datagrams may be fragmented
+    otherwise.
+
+    The option is only known on Linux. An IPv6 socket also sets it for IPv4
+    mapped addresses when it can.
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    options = [(socket.IPPROTO_IP, IP_MTU_DISCOVER)]
+    if sock.family == socket.AF_INET6:
+        options.insert(0, (socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER))
+    elif sock.family != socket.AF_INET:
+        return False
+
+    is_set = False
+    for level, option in options:
+        try:
+            sock.setsockopt(level, option, PMTUDISC_PROBE)
+            is_set = True
+        except OSError:
+            if not is_set:
+                return False
+    return is_set
+
+
+class PathMTUSearch:
+    """
+    This class searches the largest datagram size that reaches the other end
+    of a connection. The largest size is probed first, as most paths carry it,
+    then the sizes between the largest acked size and the smallest lost size
+    are bisected. A size is lost when MAX_PROBES probes of it are not acked.
+
+    It uses the following attributes:
+    low: The largest datagram size known to reach the other end.
+    high: The smallest datagram size known not to reach the other end.
+    probe_size: The size that is probed, or None when the search is done.
+    probes: The number of probes of probe_size that were sent.
+    """
+
+    def __init__(self, max_size, base_size=BASE_DATAGRAM_SIZE):
+        """
+        This function initializes the search of a size between the base size
+        and max_size.
+        """
+        self.low = min(base_size, max_size)
+        self.high = max_size + 1
+        self.probe_size = max_size if max_size > self.low else None
+        self.probes = 0
+
+    def next_probe(self):
+        """
+        This function returns the size of the next probe and counts it as sent,
+        or None when the search is done. It is called when the search starts
+        and when the previous probe is not acked in time.
+        """
+        if self.probe_size is not None and self.probes == MAX_PROBES:
+            self.high = self.probe_size
+            self.bisect()
+        if self.probe_size is not None:
+            self.probes += 1
+        return self.probe_size
+
+    def on_ack(self, size):
+        """
+        This function records that a probe of the size reached the other end.
+        It returns False for the ack of a probe that is no longer searched.
+        """
+        if size != self.probe_size:
+            return False
+        self.low = size
+        self.bisect()
+        return True
+
+    def bisect(self):
+        """
+        This function chooses the next size to probe between the largest acked
+        size and the smallest lost size.
+        """
+        self.probes = 0
+        if self.high - self.low <= SEARCH_GRANULARITY:
+            self.probe_size = None
+        else:
+            self.probe_size = (self.low + self.high) // 2
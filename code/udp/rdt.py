@@ -6,14 +6,145 @@ by the upper layer to send and receive small segments of data.
 
 import threading
 import socket
-import ast
-import hashlib
+import struct
+import time
+import errno
+import random
+import zlib
+from collections import deque
+from timer_wheel import TimerWheel, TICK_INTERVAL
+from buffer_pool import BufferPool
+from pmtu import PathMTUSearch, set_dont_fragment, BASE_DATAGRAM_SIZE
+from pacing import TokenBucket
+from wakeup import Wakeup
+from batch_io import create_datagram_io
+from congestion import create_congestion_controller
+from checksum import get_checksum, CHECKSUMS_BY_CODE
+from sequence import (
+    MAX_SEQUENCE_NUMBER,
+    HALF_SEQUENCE_SPACE,
+    seq_add,
+    seq_offset,
+    seq_before,
+    random_sequence_number,
+)
 
 BUFFER_SIZE = 4096
 WINDOW_SIZE = 1000
-MAX_SEQUENCE_NUMBER = 65535
+MAX_SACK_BLOCKS = 8
+DUPLICATE_ACK_THRESHOLD = 3
+RECEIVE_WINDOW_SIZE = 1024
+# The number of bytes that the send buffer holds. A sender waits while it is
+# full and is told that it is writable again when it is half empty.
+SEND_BUFFER_SIZE = 4 * 1024 * 1024
+CONGESTION_CONTROL = "cubic"
+CHECKSUM = "crc32"
 INITIAL_TIMER_INTERVAL = 0.5
 
+# The pacing of the sent segments: None sends them as fast as the windows
+# allow, PACING_CWND spreads the congestion window over the smoothed round trip
+# time and a number is a fixed rate in bytes per second.
+PACING_CWND = "cwnd"
+PACING = None
+# The paced rate is the congestion window over the round trip time times this
+# gain, so the window is sent before the round trip ends and the congestion
+# controller can still grow it.
+PACING_GAIN = 1.25
+# The bucket of the pacer holds this many bytes, a few segments are sent back
+# to back after the sender was idle.
+PACING_BURST = 4 * BUFFER_SIZE
+MIN_TIMER_INTERVAL = 0.2
+MAX_TIMER_INTERVAL = 60.0
+# The connection is aborted after MAX_TIMEOUTS retransmission timeouts or
+# window probes in a row without an ack, the other end is gone (as
+# tcp_retries2 in Linux).
+MAX_TIMEOUTS = 10
+RTT_SAMPLES_SIZE = 128
+# An in-order data segment is acked with the next one, or after
+# DELAYED_ACK_TIME seconds if no other segment comes (RFC 1122).
+ACK_FREQUENCY = 2
+DELAYED_ACK_TIME = 0.04
+# A small message waits at most COALESCING_DELAY seconds for more messages to
+# share its segment, while segments are in flight (as in Nagle's algorithm).
+COALESCING_DELAY = 0.005
+# A compressed data segment has the type z, its payload is the zlib stream of
+# the data compressed at this level.
+COMPRESSION_LEVEL = 1
+
+# The optional features of a connection. They are offered by the client and
+# used if the server supports them too. FEC is reserved, it is not supported.
+FEATURE_SACK = 1
+FEATURE_COMPRESSION = 2
+FEATURE_FEC = 4
+SUPPORTED_FEATURES = FEATURE_SACK | FEATURE_COMPRESSION
+FEATURES = FEATURE_SACK
+
+# A bitmask of the codes of the supported checksums.
+SUPPORTED_CHECKSUMS = sum(1 << code for code in CHECKSUMS_BY_CODE)
+
+# Constants of the retransmission timeout estimation (RFC 6298).
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+RTT_K = 4
+
+# Wire format of a segment. Every segment starts with a fixed-width binary
+# header followed by the checksum and the raw payload bytes:
+#   version (1 byte), type (1 byte), checksum type (1 byte),
+#   connection ID (4 bytes), sequence number (4 bytes), payload length (4 bytes).
+# The size of the checksum depends on the checksum type, it is computed over
+# the header and the payload.
+# The connection ID is assigned by the server in the handshake, it is 0 in
+# the initial message.
+# The version is bumped whenever the layout of the header changes.
+WIRE_VERSION = 5
+HEADER = struct.Struct("!BBBIII")
+
+# The largest payload that fits in a receive buffer with any checksum.
+MAX_SEGMENT_SIZE = (
+    BUFFER_SIZE - HEADER.size - max(c.size for c in CHECKSUMS_BY_CODE.values())
+)
+
+# The sequence number of an ack segment is the cumulative ack, the sequence
+# number of the next in-order segment expected by the receiver. Its payload is
+# the receive window advertised by the receiver in segments (4 bytes) followed
+# by a list of SACK blocks, each block is the first sequence number (4 bytes)
+# and the sequence number after the last one (4 bytes) of a range of segments
+# that are received out of order.
+ACK_WINDOW = struct.Struct("!I")
+SACK_BLOCK = struct.Struct("!II")
+
+# The payload of an initial message offers the parameters of the client: the
+# largest payload it receives (4 bytes), its receive window (4 bytes), the
+# checksum it prefers (1 byte), a bitmask of the checksums it supports (1 byte)
+# and a bitmask of the features it supports (1 byte).
+# The payload of the reply is the initial sequence number of the server
+# (4 bytes) followed by the agreed parameters: the largest payload (4 bytes),
+# the receive window of the server (4 bytes), the checksum (1 byte) and the
+# features (1 byte).
+HANDSHAKE_OFFER = struct.Struct("!IIBBB")
+HANDSHAKE_REPLY = struct.Struct("!IIIBB")
+
+# A data segment that is sent while an ack is delayed carries the ack: its
+# type is in upper case, D or Z, and its payload starts with the cumulative
+# ack (4 bytes) and the receive window (4 bytes) before the data.
+PIGGYBACK_ACK = struct.Struct("!II")
+
+# Small messages are coalesced into a data segment of type m (M with an ack).
+# Its payload is the messages one after the other, every message preceded by
+# its length (2 bytes).
+MESSAGE_LENGTH = struct.Struct("!H")
+
+# A path MTU probe has the type p, its sequence number is the size of the
+# datagram and its payload is padding. The other end acks it with a segment of
+# type q with the same sequence number and no payload.
+
+# The key of the timer that probes a closed receive window of the other end.
+PERSIST_TIMER = "persist"
+# The key of the timer of the path MTU probe.
+PMTU_TIMER = "pmtu"
+# The key of the timer of the delayed ack.
+ACK_TIMER = "ack"
+
 
 class RDT:
     """
@@ -22,28 +153,80 @@ class RDT:
 
     It uses the following attributes:
     sock: The socket used for sending and receiving data.
+    io: The batched I/O of the socket.
     is_server: A boolean indicating whether the object is a server or a client.
+    preferred_checksum: The integrity check that this end offers in the handshake.
+    checksum: The integrity check of the segments that are sent, agreed in the handshake.
+    offered_features: The bitmask of the features that this end offers in the handshake.
+    features: The bitmask of the features agreed in the handshake.
+    connection_id: The ID of the connection assigned by the server, 0 until the handshake.
+    max_segment_size: The largest payload of a segment, agreed in the handshake.
+    segment_size: The largest payload of a segment that fits the path MTU.
+    is_dont_fragment: A boolean indicating whether the datagrams are sent with the don't fragment bit.
+    path_search: The search of the path MTU, or None when no search is running.
+    pacing: None, PACING_CWND or the fixed pacing rate in bytes per second.
+    pacer: The token bucket that paces the sent data segments.
     address: The address of the other end of the connection.
-    timer_interval: The time interval for the timer.
+    timer_interval: The current retransmission timeout (RTO), including the backoff.
+    base_timer_interval: The retransmission timeout computed from the round trip time.
+    srtt: The smoothed round trip time, None until the first sample.
+    rttvar: The round trip time variation, None until the first sample.
+    rtt_samples: The most recent round trip time samples.
+    send_times: A dictionary of the times at which the messages waiting for ack were sent.
+    retransmitted: A set of the sequence numbers of the retransmitted messages.
+    backoff_time: The time of the last backoff of the retransmission timeout.
+    timeouts: The number of retransmission timeouts and window probes in a row without an ack.
     buffer_size: The size of the buffer used for sending and receiving data.
-    window_size: The size of the window used for sending data.
+    buffer_pool: The pool of the buffers that datagrams are received into.
+    window_size: The maximum size of the window used for sending data.
+    congestion_control: The name of the congestion control algorithm.
+    congestion_controller: The congestion controller that owns the congestion window.
+    recovery_point: The sequence number that ends the current loss recovery, or None.
+    peer_ack: The latest cumulative ack received from the other end.
+    peer_window: The receive window advertised by the other end with peer_ack.
+    is_timeout_recovery: A boolean indicating whether the current loss recovery started with a timeout.
     max_sequence_number: The maximum sequence number.
     id: The sequence number of the next segment to be sent.
+    isn: The random initial sequence number of this end of the connection.
+    init_id: The sequence number of the initial message of the client.
     is_connected: A boolean indicating whether the connection is established.
     close_flag: A boolean indicating whether the connection is to be closed.
     is_close_sent: A boolean indicating whether the close message is sent.
     exit_flag: A boolean indicating whether the connection is closed.
     close_id: The sequence number of the close message.
     sending_ended: A boolean indicating whether the sending is ended.
-    send_buffer: A list of messages to be sent.
-    waiting_for_ack_buffer: A dictionary of messages waiting for ack.
-    recv_buffer: A list of received messages.
-    timers: A dictionary of timers.
-    mutex: A mutex used for synchronization.
+    send_buffer: A deque of messages to be sent.
+    send_buffer_bytes: The number of bytes of the messages in the send buffer.
+    send_buffer_size: The number of bytes that the send buffer holds.
+    is_send_blocked: A boolean indicating whether a sender found the send buffer full.
+    writable_callback: The function called when the send buffer is writable again, or None.
+    send_buffer_lock: A lock that guards the send buffer, taken after the mutex if both are held.
+    writable_condition: A condition variable of send_buffer_lock used to wait for room in the send buffer.
+    waiting_for_ack_buffer: A dictionary of messages waiting for ack, in the order they are sent.
+    sacked_blocks: A dictionary of the SACK blocks already handled by the sender.
+    highest_sacked: The highest sequence number reported in a SACK block, or None.
+    last_ack: The cumulative ack of the last ack segment.
+    duplicate_acks: The number of ack segments that repeated the last cumulative ack.
+    fast_retransmitted: A set of the sequence numbers retransmitted before their timers expired.
+    lost_messages: A dictionary of the sequence numbers of the messages lost in a timeout that wait for the window to be resent, in sequence number order.
+    recv_buffer: A queue of received messages, in order, not yet read by the upper layer. It is appended to with the mutex held and read without it.
+    reorder_buffer: A dictionary of the messages received out of order.
+    receive_window_size: The number of messages that the receive buffers may hold.
+    advertised_window: The receive window advertised in the last ack.
+    unacked_segments: The number of in-order data segments whose ack is delayed.
+    coalescing_delay: The time a small message waits for more messages to share its segment.
+    coalescing_start: The time at which a small message started to wait, or None.
+    recv_next: The sequence number of the next in-order segment expected from the other end.
+    recv_blocks: A list of the [start, end) blocks of segments received out of order.
+    timers: A timer wheel that schedules the retransmission timers.
+    outgoing: A list of the (message, address) datagrams queued to be sent.
+    mutex: A mutex that guards the state of the protocol: the messages in flight, the received segments, the windows and the timers.
+    send_lock: A lock that keeps the queued datagrams in order while they are sent.
     init_condition: A condition variable used for synchronization while initializing the connection.
     close_condition: A condition variable used for synchronization while closing the connection.
-    sending_condition: A condition variable used for synchronization while sending data.
-    recv_condition: A condition variable used for synchronization while receiving data.
+    sending_condition: A wake-up of the sending thread, which waits with the mutex released.
+    recv_lock: A lock used by the upper layer to wait for received data.
+    recv_condition: A condition variable of recv_lock notified when data is received.
     sending_thread: A thread used for sending data.
     receiving_thread: A thread used for receiving data.
     """
@@ -53,11 +236,21 @@ class RDT:
         sock: socket.socket,
         is_server=True,
         address=None,
+        congestion_control=CONGESTION_CONTROL,
+        checksum=CHECKSUM,
+        features=FEATURES,
+        pacing=PACING,
     ):
         """
         This function initializes the RDT object. It takes a socket, a boolean
-        indicating whether the object is a server or a client and the address
-        of the other end of the connection as input.
+        indicating whether the object is a server or a client, the address
+        of the other end of the connection, the name of the congestion
+        control algorithm, the name of the preferred checksum, the bitmask
+        of the offered features and the pacing as input.
+
+        The handshake agrees on the checksum, the features, the segment size
+        and the connection ID. The checksum of the sent segments is carried in
+        their header, so a message is verified whatever its checksum is.
 
         It initializes the attributes of the class.
 
@@ -66,13 +259,49 @@ class RDT:
         self.sock = sock
         self.address = address
         self.is_server = is_server
+        self.preferred_checksum = get_checksum(checksum)
+        self.checksum = self.preferred_checksum
+        unsupported_features = features & ~SUPPORTED_FEATURES
+        if unsupported_features:
+            raise ValueError(f"unsupported features: {unsupported_features}")
+        self.offered_features = features
+        self.features = features
+        self.connection_id = 0
+        self.max_segment_size = MAX_SEGMENT_SIZE
+        self.segment_size = min(
+            MAX_SEGMENT_SIZE, BASE_DATAGRAM_SIZE - HEADER.size - self.checksum.size
+        )
+        self.path_search = None
 
         self.timer_interval = INITIAL_TIMER_INTERVAL
+        self.base_timer_interval = INITIAL_TIMER_INTERVAL
+        self.srtt = None
+        self.rttvar = None
+        self.rtt_samples = deque(maxlen=RTT_SAMPLES_SIZE)
+        self.send_times = {}
+        self.retransmitted = set()
+        self.backoff_time = None
+        self.timeouts = 0
         self.buffer_size = BUFFER_SIZE
+        self.buffer_pool = BufferPool(BUFFER_SIZE)
         self.window_size = WINDOW_SIZE
         self.max_sequence_number = MAX_SEQUENCE_NUMBER
+        self.congestion_control = congestion_control
+        self.congestion_controller = create_congestion_controller(
+            congestion_control, self.window_size
+        )
+        self.recovery_point = None
+        self.is_timeout_recovery = False
+        self.peer_ack = 0
+        self.peer_window = RECEIVE_WINDOW_SIZE
+        if pacing is not None and pacing != PACING_CWND and not pacing > 0:
+            raise ValueError(f"invalid pacing: {pacing}")
+        self.pacing = pacing
+        self.pacer = TokenBucket(None, PACING_BURST)
 
-        self.id = 0
+        self.isn = random_sequence_number()
+        self.id = self.isn
+        self.init_id = None
 
         self.is_connected = False
         self.close_flag = False
@@ -80,17 +309,57 @@ class RDT:
         self.exit_flag = False
         self.close_id = None
         self.sending_ended = False
-        self.send_buffer = []
+        self.send_buffer = deque()
+        self.send_buffer_bytes = 0
+        self.send_buffer_size = SEND_BUFFER_SIZE
+        self.is_send_blocked = False
+        self.writable_callback = None
         self.waiting_for_ack_buffer = {}
-        self.recv_buffer = []
-        self.timers = {}
+        self.sacked_blocks = {}
+        self.highest_sacked = None
+        self.last_ack = None
+        self.duplicate_acks = 0
+        self.fast_retransmitted = set()
+        self.lost_messages = {}
+        self.recv_buffer = deque()
+        self.reorder_buffer = {}
+        self.receive_window_size = RECEIVE_WINDOW_SIZE
+        self.advertised_window = RECEIVE_WINDOW_SIZE
+        self.recv_next = 0
+        self.recv_blocks = []
+        self.unacked_segments = 0
+        self.coalescing_delay = COALESCING_DELAY
+        self.coalescing_start = None
+
+        self.start()
+
+    def start(self):
+        """
+        This function creates the timers, the batched I/O and the
+        synchronization primitives of the connection and starts the sending and
+        receiving threads.
+        """
+        self.io = create_datagram_io(self.sock)
+        self.is_dont_fragment = set_dont_fragment(self.sock)
+        self.timers = TimerWheel(self.resend)
+        self.outgoing = []
 
         self.mutex = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.send_buffer_lock = threading.Lock()
+        self.recv_lock = threading.Lock()
         self.init_condition = threading.Condition(self.mutex)
         self.close_condition = threading.Condition(self.mutex)
-        self.sending_condition = threading.Condition(self.mutex)
-        self.recv_condition = threading.Condition(self.mutex)
+        self.sending_condition = Wakeup(self.mutex)
+        self.recv_condition = threading.Condition(self.recv_lock)
+        self.writable_condition = threading.Condition(self.send_buffer_lock)
+
+        self.start_threads()
 
+    def start_threads(self):
+        """
+        This function starts the sending and receiving threads.
+        """
         self.sending_thread = threading.Thread(target=self.sending_thread_func)
         self.receiving_thread = threading.Thread(target=self.receiving_thread_func)
 
@@ -106,15 +375,15 @@ class RDT:
         """
         with self.mutex:
             # Send initial message, start timer and wait for ack.
-            checksum = self.compute_checksum("i", self.id, 0, "")
-            msg = self.message_formatter("i", self.id, 0, checksum, "")
+            msg = self.initial_message()
             self._send(msg, self.address)
             self.waiting_for_ack_buffer[self.id] = msg
-            timer = threading.Timer(self.timer_interval, self.resend, [0])
-            timer.start()
-            self.timers[self.id] = timer
-            self.id += 1
-            self.init_condition.wait()
+            self.start_timer(self.id)
+            self.id = seq_add(self.id, 1)
+            self.peer_ack = self.id
+            self.flush_locked()
+            if not self.is_connected:
+                self.init_condition.wait()
 
             # If the connection is not established, return False.
             # Otherwise, return True.
@@ -126,307 +395,1513 @@ class RDT:
                 print(f"Connection initialized with {self.address}")
                 return True
 
-    def compute_checksum(self, type, id, length, message):
+    def initial_message(self):
+        """
+        This function returns the initial message of the client, which offers
+        the parameters of the connection to the server.
+        """
+        data = HANDSHAKE_OFFER.pack(
+            MAX_SEGMENT_SIZE,
+            self.receive_window_size,
+            self.preferred_checksum.code,
+            SUPPORTED_CHECKSUMS,
+            self.offered_features,
+        )
+        checksum = self.compute_checksum("i", self.id, len(data), data)
+        return self.message_formatter("i", self.id, len(data), checksum, data)
+
+    def negotiate(self, offer):
+        """
+        This function is called by the server with the parameters offered in
+        an initial message. It assigns the connection ID and agrees on the
+        largest payload, the checksum and the features, and records the
+        receive window of the client.
+
+        The checksum preferred by the client is used if it is known, else the
+        preferred checksum of the server if the client supports it, else CRC32.
+        """
+        max_segment_size, window, checksum_code, checksums, features = offer
+        self.connection_id = self.new_connection_id()
+        self.max_segment_size = min(max_segment_size, MAX_SEGMENT_SIZE)
+        self.peer_window = window
+        if checksum_code in CHECKSUMS_BY_CODE:
+            self.checksum = CHECKSUMS_BY_CODE[checksum_code]
+        elif checksums & (1 << self.preferred_checksum.code):
+            self.checksum = self.preferred_checksum
+        else:
+            self.checksum = get_checksum("crc32")
+        self.features = features & self.offered_features
+
+    def new_connection_id(self):
+        """
+        This function returns a random connection ID, which is never 0.
+        """
+        return random.randrange(1, 1 << 32)
+
+    def compute_checksum(
+        self, type, id, length, message, checksum=None, connection_id=None
+    ):
         """
         This function computes the checksum of the message. It takes the type,
         sequence number, length and data as input and returns the checksum.
+
+        The checksum covers the header and the payload. It is computed with the
+        checksum and the connection ID of the connection unless others are given.
         """
-        payload = self.message_formatter(type, id, length, 0, message)
-        hash_function = hashlib.md5()
-        hash_function.update(payload.encode("utf-8"))
-        checksum = hash_function.hexdigest()
-        return checksum
+        if checksum is None:
+            checksum = self.checksum
+        if connection_id is None:
+            connection_id = self.connection_id
+        header = HEADER.pack(
+            WIRE_VERSION, ord(type), checksum.code, connection_id, id, length
+        )
+        return checksum.compute(header, message)
 
     def sending_thread_func(self):
         """
         This function is the target of the sending thread. It sends the data
         in the send buffer to the other end of the connection up to the window size.
 
+        The segments are queued and sent in bursts of up to a batch, the queue
+        is flushed before the thread waits. The messages lost in a timeout are
+        resent before new segments, as the window allows. If pacing is enabled, the thread
+        waits for the pacer before every new segment. Retransmissions take
+        their tokens from the pacer but are not delayed. Small messages wait
+        a little for more messages to coalesce with.
+
         It also handles the close procedure. If the close flag is set and send buffer
         is empty, it notifies the close condition. If the object is a server, it waits
-        for the sending thread to end. If the object is a client, it returns.
+        for the sending thread to end. If the object is a client, it returns once
+        every message is acked, until then it resends the lost messages.
         """
 
         with self.mutex:
-            while True:
-                #  Wait until the window is not full.
-                if len(self.waiting_for_ack_buffer.keys()) <= self.window_size:
-                    # if the send buffer is empty and the close flag is not set, wait.
-                    if len(self.send_buffer) == 0 and not self.close_flag:
+            while not self.exit_flag:
+                # Resend the messages lost in a timeout before the new ones.
+                if self.lost_messages:
+                    if self.in_flight() < self.send_window():
+                        self.resend_lost_message()
+                        if len(self.outgoing) >= self.io.batch_size:
+                            self.flush_locked()
+                    else:
+                        self.wait_for_sending()
+                    continue
+
+                # if the send buffer is empty and the close flag is not set, wait.
+                if len(self.send_buffer) == 0 and not self.close_flag:
+                    self.wait_for_sending()
+                    continue
+
+                # if the send buffer is empty and the close flag is set, notify the close condition.
+                elif len(self.send_buffer) == 0 and self.close_flag:
+                    if self.outgoing:
+                        self.flush_locked()
+                        continue
+                    self.close_condition.notify()
+                    if self.is_server:
+                        self.sending_ended = True
                         self.sending_condition.wait()
                         continue
+                    elif self.waiting_for_ack_buffer:
+                        self.sending_condition.wait()
+                        continue
+                    else:
+                        return
+
+                # Wait until the windows are open.
+                if not self.can_send_segment():
+                    self.wait_for_sending()
+                    continue
+
+                # Wait a little for more small messages to share the segment.
+                delay = self.coalescing_delay_left()
+                if delay > 0:
+                    self.wait_for_sending(delay)
+                    continue
+
+                # Wait until the pacer lets the next segment go.
+                delay = self.pacing_delay()
+                if delay > 0:
+                    self.wait_for_sending(delay)
+                    continue
+
+                # Send the next message, a full batch is flushed at once.
+                self.send_segment()
+                if self.is_send_blocked and self.is_writable():
+                    self.notify_writable()
+                if len(self.outgoing) >= self.io.batch_size:
+                    self.flush_locked()
+
+    def can_send_segment(self):
+        """
+        This function returns whether the next message of the send buffer may
+        be sent: the window must not be full and the receive window of the
+        other end must be open. If nothing is in flight, no ack will open the
+        receive window of the other end, so it is probed.
+        """
+        if self.in_flight() >= self.send_window():
+            return False
+
+        if not self.is_peer_window_open():
+            if (
+                len(self.waiting_for_ack_buffer) == 0
+                and PERSIST_TIMER not in self.timers
+            ):
+                self.timers.arm(PERSIST_TIMER, self.timer_interval)
+            return False
+        return True
+
+    def coalescing_delay_left(self):
+        """
+        This function returns how long the messages of the send buffer still
+        wait for more messages to coalesce with, 0 if they are sent now.
+
+        They wait while they fill less than half of a segment and segments are
+        in flight, whose acks will wake up the sender anyway, for at most the
+        coalescing delay. A closing connection sends them at once.
+        """
+        size = self.send_buffer_bytes + len(self.send_buffer) * MESSAGE_LENGTH.size
+        if (
+            not self.coalescing_delay
+            or self.close_flag
+            or not self.waiting_for_ack_buffer
+            or size * 2 > self.segment_size
+        ):
+            self.coalescing_start = None
+            return 0
+
+        now = time.monotonic()
+        if self.coalescing_start is None:
+            self.coalescing_start = now
+        delay = self.coalescing_start + self.coalescing_delay - now
+        if delay <= 0:
+            self.coalescing_start = None
+            return 0
+        return delay
+
+    def take_messages(self):
+        """
+        This function takes the next message of the send buffer together with
+        the messages after it that fit in the same segment. The senders that
+        wait for room in the send buffer are woken up.
+
+        It is called by the sending thread with the mutex held and holds the
+        lock of the send buffer only while the messages are taken.
+        """
+        with self.send_buffer_lock:
+            count = 0
+            size = 0
+            for msg in self.send_buffer:
+                size += MESSAGE_LENGTH.size + len(msg)
+                if size > self.segment_size:
+                    break
+                count += 1
+            messages = [self.send_buffer.popleft() for _ in range(max(count, 1))]
+            self.send_buffer_bytes -= sum(len(msg) for msg in messages)
+            if self.is_send_blocked:
+                self.writable_condition.notify_all()
+        return messages
+
+    def queue_messages(self, msgs, start):
+        """
+        This function appends the messages of msgs from index start to the
+        send buffer while it has room for them, and returns how many are
+        appended. A message is always appended to an empty send buffer.
+
+        It is called with the lock of the send buffer held, not the mutex, so
+        the acks are handled while a large batch is appended. The sending
+        thread is woken up without the mutex.
+        """
+        count = 0
+        for msg in msgs[start:]:
+            if (
+                self.send_buffer
+                and self.send_buffer_bytes + len(msg) > self.send_buffer_size
+            ):
+                break
+            self.send_buffer.append(msg)
+            self.send_buffer_bytes += len(msg)
+            count += 1
+        if count:
+            self.sending_condition.notify()
+        return count
+
+    def is_writable(self):
+        """
+        This function returns whether the send buffer is at most half full.
+        """
+        return self.send_buffer_bytes <= self.send_buffer_size // 2
+
+    def set_writable_callback(self, callback):
+        """
+        This function sets the function that is called without arguments when
+        the send buffer is writable again after a sender found it full. It is
+        called by the sending thread without the mutex held, None removes it.
+        """
+        with self.send_buffer_lock:
+            self.writable_callback = callback
+
+    def notify_writable(self):
+        """
+        This function is called by the sending thread with the mutex held when
+        the send buffer is writable again. It calls the writable callback with
+        the mutex released.
+        """
+        with self.send_buffer_lock:
+            self.is_send_blocked = False
+        callback = self.writable_callback
+        if callback is not None:
+            self.mutex.release()
+            try:
+                callback()
+            finally:
+                self.mutex.acquire()
+
+    def pacing_rate(self):
+        """
+        This function returns the rate at which the data segments are paced in
+        bytes per second, or None if they are not paced. The rate of
+        PACING_CWND is the congestion window of full segments over the smoothed
+        round trip time, the segments are not paced until it is measured.
+        """
+        if self.pacing != PACING_CWND:
+            return self.pacing
+        if not self.srtt:
+            return None
+        datagram_size = self.segment_size + HEADER.size + self.checksum.size
+        return PACING_GAIN * self.send_window() * datagram_size / self.srtt
 
-                    # if the send buffer is empty and the close flag is set, notify the close condition.
-                    elif len(self.send_buffer) == 0 and self.close_flag:
-                        self.close_condition.notify()
-                        if self.is_server:
-                            self.sending_ended = True
-                            self.sending_condition.wait()
-                            continue
-                        else:
-                            return
-
-                    # get the message from the send buffer and send it.
-                    message = self.send_buffer.pop(0)
-                    id = self.id
-                    length = len(message)
-                    checksum = self.compute_checksum("d", id, length, message)
-                    segment = self.message_formatter("d", id, length, checksum, message)
-                    self.waiting_for_ack_buffer[id] = segment
-
-                    # Start timer for this sequence number
-                    timer = threading.Timer(self.timer_interval, self.resend, [id])
-                    timer.start()
-                    self.timers[id] = timer
-
-                    # Increment the sequence number
-                    self.id += 1
-                    if self.id > self.max_sequence_number:
-                        self.id = 0
-
-                    # Send the message
-                    self._send(segment, self.address)
+    def pacing_delay(self):
+        """
+        This function updates the rate of the pacer and returns the time until
+        the next data segment may be sent, 0 if it may be sent now.
+        """
+        if self.pacing is None:
+            return 0
+        now = time.monotonic()
+        self.pacer.set_rate(self.pacing_rate(), now)
+        return self.pacer.delay(now)
+
+    def send_segment(self):
+        """
+        This function sends the next message of the send buffer as a data
+        segment and starts its retransmission timer. If compression is agreed,
+        the message is sent compressed when that makes it smaller. Small
+        messages that follow each other in the send buffer are coalesced into
+        one segment. A delayed ack is piggybacked on the segment if it fits.
+        """
+        # get the messages from the send buffer and send them.
+        messages = self.take_messages()
+        self.coalescing_start = None
+        if len(messages) > 1:
+            type = "m"
+            message = b"".join(
+                part
+                for msg in messages
+                for part in (MESSAGE_LENGTH.pack(len(msg)), msg)
+            )
+        else:
+            type = "d"
+            message = messages[0]
+            if self.features & FEATURE_COMPRESSION:
+                compressed = zlib.compress(message, COMPRESSION_LEVEL)
+                if len(compressed) < len(message):
+                    type = "z"
+                    message = compressed
+        if (
+            self.unacked_segments
+            and len(message) + PIGGYBACK_ACK.size <= self.segment_size
+        ):
+            type = type.upper()
+            self.advertised_window = self.receive_window()
+            message = b"".join(
+                (PIGGYBACK_ACK.pack(self.recv_next, self.advertised_window), message)
+            )
+            self.clear_delayed_ack()
+        id = self.id
+        length = len(message)
+        checksum = self.compute_checksum(type, id, length, message)
+        segment = self.message_formatter(type, id, length, checksum, message)
+        self.waiting_for_ack_buffer[id] = segment
+
+        # Start timer for this sequence number
+        self.start_timer(id)
+
+        # Increment the sequence number
+        self.id = seq_add(self.id, 1)
+
+        self._send(segment, self.address)
+        self.pacer.consume(len(segment), time.monotonic())
+
+    def wait_for_sending(self, timeout=None):
+        """
+        This function is called by the sending thread with the mutex held when
+        it can not send more segments, for at most timeout seconds if it is
+        given. The queued segments are flushed first, the thread waits only
+        when nothing is left to flush.
+        """
+        if self.outgoing:
+            self.flush_locked()
+        else:
+            self.sending_condition.wait(timeout)
+
+    def start_timer(self, id):
+        """
+        This function records the time at which a message is sent for the
+        first time and starts its retransmission timer.
+        """
+        self.send_times[id] = time.monotonic()
+        self.timers.arm(id, self.timer_interval)
+
+    def resend(self, ids):
+        """
+        This function is called by the timer wheel with the sequence numbers
+        whose timers expired in the same tick. It resends the messages and
+        restarts their timers under a single acquisition of the mutex.
+
+        The expiration is a single timeout event, so the retransmission timeout
+        is backed off at most once for the whole batch. The timers of a lost
+        window expire over a round trip time, the congestion controller reacts
+        once until the timeout recovery ends.
+
+        Only the oldest message waiting for ack is resent at once, as with a
+        single retransmission timer. The other expired messages are marked as
+        lost and their timers stop, the sending thread resends them as the
+        congestion window, which the timeout shrinks, grows again.
 
+        A message may be acked after its timer expired but before this function
+        acquires the mutex, such messages are skipped.
+
+        The expiry of the persist timer sends a window probe instead, the
+        expiry of the path MTU timer sends the next path MTU probe and the
+        expiry of the delayed ack timer sends the ack.
+
+        The window probes back off as the retransmissions do. The connection is
+        aborted after MAX_TIMEOUTS timeouts or unanswered probes in a row.
+        """
+        with self.mutex:
+            if ACK_TIMER in ids and self.unacked_segments:
+                self.send_ack()
+            if PMTU_TIMER in ids:
+                self.send_path_probe()
+            if PERSIST_TIMER in ids and not self.is_peer_window_open():
+                if self.backoff_timer_interval():
+                    self.timeouts += 1
+                checksum = self.compute_checksum("w", self.id, 0, b"")
+                probe = self.message_formatter("w", self.id, 0, checksum, b"")
+                self._send(probe, self.address)
+                self.sending_condition.notify()
+            ids = [id for id in ids if id in self.waiting_for_ack_buffer]
+            if ids and self.backoff_timer_interval():
+                self.timeouts += 1
+                if not self.is_timeout_recovery:
+                    self.congestion_controller.on_timeout()
+                    self.recovery_point = self.id
+                    self.is_timeout_recovery = True
+            if self.timeouts > MAX_TIMEOUTS:
+                self.abort()
+                return
+            oldest = next(iter(self.waiting_for_ack_buffer), None)
+            for id in sorted(ids, key=lambda id: seq_offset(self.peer_ack, id)):
+                if id == oldest:
+                    self._send(self.waiting_for_ack_buffer[id], self.address)
+                    self.pacer.consume(
+                        len(self.waiting_for_ack_buffer[id]), time.monotonic()
+                    )
+                    self.retransmitted.add(id)
+                    self.timers.arm(id, self.timer_interval)
                 else:
-                    self.sending_condition.wait()  # wait until the window is not full
+                    self.lost_messages[id] = None
+            if self.lost_messages:
+                self.sending_condition.notify()
+        self.flush()
+
+    def resend_lost_message(self):
+        """
+        This function resends the first message lost in a timeout and restarts
+        its timer. It is called by the sending thread when the window has room
+        for the message. Retransmissions take their tokens from the pacer but
+        are not delayed.
+        """
+        id = next(iter(self.lost_messages))
+        del self.lost_messages[id]
+        self._send(self.waiting_for_ack_buffer[id], self.address)
+        self.pacer.consume(len(self.waiting_for_ack_buffer[id]), time.monotonic())
+        self.retransmitted.add(id)
+        self.timers.arm(id, self.timer_interval)
+
+    def update_timer_interval(self, rtt):
+        """
+        This function updates the smoothed round trip time, the round trip
+        time variation and the retransmission timeout with a new round trip
+        time sample as described in RFC 6298. A new sample also clears the
+        exponential backoff of the retransmission timeout.
+        """
+        self.rtt_samples.append(rtt)
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        # As in Linux, the minimum bounds the variation term rather than the
+        # whole timeout, a spurious timeout collapses the congestion window.
+        interval = self.srtt + max(
+            TICK_INTERVAL, RTT_K * self.rttvar, MIN_TIMER_INTERVAL
+        )
+        self.base_timer_interval = min(interval, MAX_TIMER_INTERVAL)
+        self.timer_interval = self.base_timer_interval
+
+    def backoff_timer_interval(self):
+        """
+        This function doubles the retransmission timeout after a timeout, up
+        to the maximum timer interval.
 
-    def resend(self, id):
+        Every message has its own timer, so the timers of a window that is
+        lost together expire over several ticks. The timeout is doubled at
+        most once per retransmission timeout, as if there was a single timer.
+
+        It returns whether the timeout is backed off.
+        """
+        now = time.monotonic()
+        if (
+            self.backoff_time is not None
+            and now - self.backoff_time < self.timer_interval
+        ):
+            return False
+        self.backoff_time = now
+        self.timer_interval = min(self.timer_interval * 2, MAX_TIMER_INTERVAL)
+        return True
+
+    def get_rtt_stats(self):
         """
-        This function is called when the timer for a message expires. It resends
-        the message and restarts the timer.
+        This function returns the round trip time estimation of the connection:
+        the smoothed round trip time, the round trip time variation, the
+        current retransmission timeout and the most recent samples.
         """
         with self.mutex:
-            segment = self.waiting_for_ack_buffer[id]
-            self.timers.pop(id, None)
-            self._send(segment, self.address)
-            timer = threading.Timer(self.timer_interval, self.resend, [id])
-            timer.start()
-            self.timers[id] = timer
+            return {
+                "srtt": self.srtt,
+                "rttvar": self.rttvar,
+                "rto": self.timer_interval,
+                "samples": list(self.rtt_samples),
+            }
+
+    def get_pacing_stats(self):
+        """
+        This function returns the pacing of the connection: the current rate,
+        the tokens and the counters of the pacer.
+        """
+        with self.mutex:
+            stats = self.pacer.stats()
+            stats["pacing"] = self.pacing
+            return stats
 
     def ack_handler(self, id):
         """
         This function is called when an ack is received. It cancels the timer
         for the message and removes the message from the waiting for ack buffer.
+
+        The ack gives a round trip time sample unless the message was
+        retransmitted, in which case the ack is ambiguous (Karn's rule). It
+        still shows that the path delivers again, so the backoff is cleared.
+
+        It returns whether the message was waiting for ack.
+        """
+        if self.waiting_for_ack_buffer.pop(id, None) is None:
+            return False
+        self.timers.cancel(id)
+        self.timeouts = 0
+        self.fast_retransmitted.discard(id)
+        self.lost_messages.pop(id, None)
+        send_time = self.send_times.pop(id, None)
+        if id in self.retransmitted:
+            self.retransmitted.discard(id)
+            self.timer_interval = self.base_timer_interval
+        elif send_time is not None:
+            self.update_timer_interval(time.monotonic() - send_time)
+        return True
+
+    def in_flight(self):
+        """
+        This function returns the number of messages in flight: the messages
+        waiting for ack but the ones lost in a timeout, which are not resent
+        yet.
+        """
+        return len(self.waiting_for_ack_buffer) - len(self.lost_messages)
+
+    def send_window(self):
+        """
+        This function returns the number of messages that may be waiting for
+        ack, the congestion window bounded by the window size.
         """
-        self.waiting_for_ack_buffer.pop(id, None)
-        timer = self.timers.pop(id, None)
-        if timer:
-            timer.cancel()
+        return min(self.window_size, self.congestion_controller.window())
+
+    def is_peer_window_open(self):
+        """
+        This function returns whether the next message is inside the receive
+        window advertised by the other end.
+        """
+        return seq_offset(self.peer_ack, self.id) < self.peer_window
+
+    def cumulative_ack_handler(self, ack, window, sack_blocks):
+        """
+        This function is called when an ack segment is received. It retires
+        every message before the cumulative ack and every message in the SACK
+        blocks, so a single ack can retire many messages and a lost ack is
+        covered by the next one. It also records the receive window advertised
+        with the latest cumulative ack.
+
+        The messages in the waiting for ack buffer are in sequence number order,
+        so the messages before the cumulative ack are at its front. A SACK
+        block is repeated in the following acks, only the part of it that is
+        not handled before is walked.
+
+        An ack after the next sequence number acks messages that were never
+        sent, it is dropped. The SACK blocks are clamped to the messages that
+        are sent and not acked, so a corrupt block walks at most the window.
+
+        The number of retired messages is reported to the congestion
+        controller, except during a loss recovery that started with a fast
+        retransmit. After a timeout the window grows again in slow start.
+        """
+        if seq_before(self.id, ack):
+            return
+        # Any ack shows that the other end is alive.
+        self.timeouts = 0
+
+        if not seq_before(ack, self.peer_ack):
+            self.peer_ack = ack
+            self.peer_window = window
+            if self.is_peer_window_open():
+                self.timers.cancel(PERSIST_TIMER)
+
+        acked = 0
+        while self.waiting_for_ack_buffer:
+            id = next(iter(self.waiting_for_ack_buffer))
+            if not seq_before(id, ack):
+                break
+            acked += self.ack_handler(id)
+
+        for start in list(self.sacked_blocks):
+            if not seq_before(ack, self.sacked_blocks[start]):
+                del self.sacked_blocks[start]
+
+        if self.highest_sacked is not None and seq_before(self.highest_sacked, ack):
+            self.highest_sacked = None
+
+        if ack == self.last_ack and self.waiting_for_ack_buffer:
+            self.duplicate_acks += 1
+        else:
+            self.last_ack = ack
+            self.duplicate_acks = 0
+
+        for start, end in sack_blocks:
+            if seq_before(self.id, end):
+                end = self.id
+            if not seq_before(self.peer_ack, end) or not seq_before(start, end):
+                continue
+            last = seq_add(end, -1)
+            if self.highest_sacked is None or seq_before(self.highest_sacked, last):
+                self.highest_sacked = last
+            handled_end = self.sacked_blocks.get(start, start)
+            if seq_before(handled_end, self.peer_ack):
+                handled_end = self.peer_ack
+            if not seq_before(handled_end, end):
+                continue
+            id = handled_end
+            while id != end:
+                acked += self.ack_handler(id)
+                id = seq_add(id, 1)
+            self.sacked_blocks[start] = end
+
+        if self.recovery_point is not None and not seq_before(ack, self.recovery_point):
+            self.recovery_point = None
+            self.is_timeout_recovery = False
+        if acked and (self.recovery_point is None or self.is_timeout_recovery):
+            self.congestion_controller.on_ack(acked, self.srtt)
+
+        self.fast_retransmit(ack)
+
+    def fast_retransmit(self, ack):
+        """
+        This function retransmits the messages that are inferred to be lost
+        without waiting for their timers to expire.
+
+        A message is lost if the cumulative ack is repeated
+        DUPLICATE_ACK_THRESHOLD times while it is the next expected message, or
+        if a SACK block reports a message at least DUPLICATE_ACK_THRESHOLD
+        sequence numbers after it. SACKed messages leave the waiting for ack
+        buffer, so the lost messages are the ones at its front.
+
+        A message is retransmitted this way at most once, if the retransmission
+        is lost too, its timer recovers it.
+
+        The first loss starts a loss recovery that lasts until every message
+        sent before it is acked, the congestion controller reacts once per
+        recovery.
+        """
+        lost = []
+        if (
+            self.duplicate_acks >= DUPLICATE_ACK_THRESHOLD
+            and ack in self.waiting_for_ack_buffer
+        ):
+            lost.append(ack)
+
+        if self.highest_sacked is not None:
+            for id in self.waiting_for_ack_buffer:
+                distance = seq_offset(id, self.highest_sacked)
+                if (
+                    distance < DUPLICATE_ACK_THRESHOLD
+                    or distance >= HALF_SEQUENCE_SPACE
+                ):
+                    break
+                lost.append(id)
+
+        for id in lost:
+            if id in self.fast_retransmitted:
+                continue
+            if self.recovery_point is None:
+                self.congestion_controller.on_loss()
+                self.recovery_point = self.id
+            self.fast_retransmitted.add(id)
+            self.lost_messages.pop(id, None)
+            self.retransmitted.add(id)
+            self._send(self.waiting_for_ack_buffer[id], self.address)
+            self.pacer.consume(len(self.waiting_for_ack_buffer[id]), time.monotonic())
+            self.timers.arm(id, self.timer_interval)
+
+    def receive_window(self):
+        """
+        This function returns the number of messages after the cumulative ack
+        that the receiver can hold. The messages in order that are not read by
+        the upper layer use the window.
+        """
+        return max(self.receive_window_size - len(self.recv_buffer), 0)
+
+    def receive_data(self, id, data, address):
+        """
+        This function handles a received data segment. Segments outside the
+        receive window and duplicates are dropped. A segment received out of
+        order waits in the reorder buffer, a segment received in order is
+        released to the receive buffer together with the segments after it
+        that wait in the reorder buffer.
+
+        data is a view of a buffer of the buffer pool. The buffer is kept until
+        the upper layer reads the data, a dropped segment releases it at once.
+        The data of a coalesced segment is a list of the views of its
+        messages, which do not use the buffer pool.
+
+        It returns the block that contains the segment, or None.
+        """
+        offset = seq_offset(self.recv_next, id)
+        if offset < HALF_SEQUENCE_SPACE and offset >= self.receive_window():
+            self.release_data(data)
+            return None
+
+        start = self.recv_next
+        is_new, block = self.record_received(id)
+        if not is_new:
+            self.release_data(data)
+            return block
+        if id != start:
+            self.reorder_buffer[id] = (data, address)
+            return block
+
+        self.deliver(data, address)
+        id = seq_add(id, 1)
+        while id != self.recv_next:
+            self.deliver(*self.reorder_buffer.pop(id))
+            id = seq_add(id, 1)
+        with self.recv_lock:
+            self.recv_condition.notify()
+        return block
+
+    def deliver(self, data, address):
+        """
+        This function appends the data of a segment received in order to the
+        receive buffer, every message of a coalesced segment on its own.
+        """
+        if isinstance(data, list):
+            self.recv_buffer.extend((message, address) for message in data)
+        else:
+            self.recv_buffer.append((data, address))
+
+    def release_data(self, data):
+        """
+        This function gives the buffer of a dropped data segment back to the
+        buffer pool.
+        """
+        if not isinstance(data, list):
+            self.buffer_pool.release(data.obj)
+
+    def unpack_messages(self, data):
+        """
+        This function returns the messages of a coalesced data segment as a
+        list of memoryviews, or None if the segment is malformed. The messages
+        are small, they are copied once so the buffer is reused at once.
+        """
+        data = memoryview(bytes(data))
+        messages = []
+        offset = 0
+        while offset < len(data):
+            if offset + MESSAGE_LENGTH.size > len(data):
+                return None
+            (length,) = MESSAGE_LENGTH.unpack_from(data, offset)
+            offset += MESSAGE_LENGTH.size
+            if offset + length > len(data):
+                return None
+            messages.append(data[offset : offset + length])
+            offset += length
+        return messages
+
+    def record_received(self, id):
+        """
+        This function records that the data segment with the sequence number
+        id is received. It advances the cumulative ack over the segments that
+        are received in order and keeps the segments that are received out of
+        order in blocks.
+
+        It returns whether the segment is new and the block that contains the
+        segment, or None if the segment is in order or is received before.
+        """
+        offset = seq_offset(self.recv_next, id)
+        if offset >= HALF_SEQUENCE_SPACE:
+            return False, None
+
+        if offset == 0:
+            self.recv_next = seq_add(self.recv_next, 1)
+            if self.recv_blocks and self.recv_blocks[0][0] == self.recv_next:
+                self.recv_next = self.recv_blocks.pop(0)[1]
+            return True, None
+
+        # Find the first block that ends at or after the segment.
+        index = 0
+        while index < len(self.recv_blocks) and (
+            seq_offset(self.recv_next, self.recv_blocks[index][1]) < offset
+        ):
+            index += 1
+
+        if index < len(self.recv_blocks):
+            block = self.recv_blocks[index]
+            if (
+                seq_offset(self.recv_next, block[0])
+                <= offset
+                < seq_offset(self.recv_next, block[1])
+            ):
+                return False, block
+            if block[1] == id:
+                block[1] = seq_add(id, 1)
+                next_index = index + 1
+                if (
+                    next_index < len(self.recv_blocks)
+                    and self.recv_blocks[next_index][0] == block[1]
+                ):
+                    block[1] = self.recv_blocks.pop(next_index)[1]
+                return True, block
+            if block[0] == seq_add(id, 1):
+                block[0] = id
+                return True, block
+
+        block = [id, seq_add(id, 1)]
+        self.recv_blocks.insert(index, block)
+        return True, block
+
+    def send_ack(self, recent_block=None):
+        """
+        This function sends an ack segment with the cumulative ack, the receive
+        window and up to MAX_SACK_BLOCKS SACK blocks. The block that contains
+        the most recently received segment is reported first, as in RFC 2018.
+        The SACK blocks are only sent if SACK is agreed. The ack covers the
+        delayed ack.
+        """
+        self.clear_delayed_ack()
+        blocks = []
+        if self.features & FEATURE_SACK:
+            blocks = self.recv_blocks[:MAX_SACK_BLOCKS]
+            if recent_block is not None and recent_block not in blocks[:1]:
+                blocks = [recent_block] + [
+                    block for block in blocks if block is not recent_block
+                ]
+                blocks = blocks[:MAX_SACK_BLOCKS]
+        self.advertised_window = self.receive_window()
+        data = ACK_WINDOW.pack(self.advertised_window) + b"".join(
+            SACK_BLOCK.pack(start, end) for start, end in blocks
+        )
+        checksum = self.compute_checksum("a", self.recv_next, len(data), data)
+        ack = self.message_formatter("a", self.recv_next, len(data), checksum, data)
+        self._send(ack, self.address)
+
+    def delay_ack(self):
+        """
+        This function delays the ack of an in-order data segment. Every
+        ACK_FREQUENCY-th segment is acked at once, the others when the delayed
+        ack timer expires or on the next data segment that is sent.
+        """
+        self.unacked_segments += 1
+        if self.unacked_segments >= ACK_FREQUENCY:
+            self.send_ack()
+        elif self.unacked_segments == 1:
+            self.timers.arm(ACK_TIMER, DELAYED_ACK_TIME)
+
+    def clear_delayed_ack(self):
+        """
+        This function is called when the delayed ack is sent, alone or on a
+        data segment. It cancels the delayed ack timer.
+        """
+        if self.unacked_segments:
+            self.unacked_segments = 0
+            self.timers.cancel(ACK_TIMER)
 
     def receiving_thread_func(self):
         """
         This function is the target of the receiving thread. It receives the
         data from the network and handles the received data.
 
-        It listens on the socket and receives data. It parses the received data
-        and checks the header. If the header is corrupted, it continues listening.
-        If the header is not corrupted, it checks the checksum. If the checksum
-        is not equal to the computed checksum, it continues listening. If the
-        checksum is equal to the computed checksum, it handles the message.
+        It listens on the socket and receives the datagrams that wait on it in
+        a batch, every datagram into a buffer of the buffer pool. A buffer is
+        reused for the next batch after its message is handled, unless the
+        message is data that waits for the upper layer. The thread ends when
+        the connection is closed.
+        """
+        buffers = []
+        while not self.exit_flag:
+            while len(buffers) < self.io.batch_size:
+                buffers.append(self.buffer_pool.acquire())
+            received = self.io.recv(buffers)
+            is_kept = self.handle_messages(
+                [
+                    (memoryview(buffer)[:nbytes], address)
+                    for (nbytes, address), buffer in zip(received, buffers)
+                ]
+            )
+
+            buffers = [
+                buffer for buffer, kept in zip(buffers, is_kept) if not kept
+            ] + buffers[len(received) :]
+
+        for buffer in buffers:
+            self.buffer_pool.release(buffer)
+
+    def handle_messages(self, received):
+        """
+        This function handles a batch of (message, address) pairs received
+        from the network. The messages are verified without the mutex and the
+        whole batch is handled under a single acquisition of it, the segments
+        queued meanwhile are flushed afterwards.
+
+        It returns whether the buffer of every message is kept by the receive
+        buffers.
+        """
+        messages = [self.verify_message(message) for message, _ in received]
+        is_kept = []
+        with self.mutex:
+            for message, (_, address) in zip(messages, received):
+                is_kept.append(
+                    message is not None and self.message_handler(*message, address)
+                )
+        self.flush()
+        return is_kept
+
+    def verify_message(self, message):
+        """
+        This function parses a message received from the network and checks
+        its integrity. It returns the type, connection ID, sequence number,
+        length and data of the message, or None if the message is corrupted.
+
+        If the header is corrupted, the message is dropped. If the header is
+        not corrupted, it checks the checksum. If the checksum is not equal to
+        the computed checksum, the message is dropped.
+        """
+        (
+            type,
+            connection_id,
+            id,
+            length,
+            checksum_type,
+            checksum,
+            data,
+            is_header_corrupted,
+        ) = self.message_parser(message)
+        if is_header_corrupted:  # The header is corrupted. It can not be parsed.
+            return None
+        computed_checksum = self.compute_checksum(
+            type, id, length, data, checksum_type, connection_id
+        )
+        # The checksum is not equal to the computed checksum.
+        # The message is corrupted.
+        if computed_checksum != checksum:
+            return None
+        return type, connection_id, id, length, data
+
+    def message_handler(self, type, connection_id, id, length, data, client_address):
+        """
+        This function handles a verified message received from the network.
+        It is called with the mutex held. It returns whether the buffer of the
+        message is kept by the receive buffers.
+
+        Only the initial message and its reply are handled before the
+        connection is established, the messages of other connections are
+        dropped.
 
         If the message is an initial message, it sends an ack and sets the
         connection status to True. If the message is an ack, it handles the ack.
 
         If the message is a data message, it adds the message to the receive
-        buffer and sends an ack.
+        buffer and acks it. An in-order message is acked with the next one or
+        after a delay, the others at once. The ack that a data message carries
+        is handled first, a compressed data message is decompressed and a
+        coalesced one is split into its messages.
 
         If the message is a close message, it sets the close flag to True waits for appropriate
         conditions to close the connection by sending ack to the close message.
         """
-        while True:
-            message, client_address = self.sock.recvfrom(self.buffer_size)
-            message = message.decode("utf-8")
-            type, id, length, checksum, data, is_header_corrupted = self.message_parser(
-                message
+        if type != "i" and type != "s":
+            if not self.is_connected or connection_id != self.connection_id:
+                return False
+
+        if type == "i" and self.is_server:
+            if length != HANDSHAKE_OFFER.size:
+                return False
+            # A retransmitted initial message of the current client
+            # only needs the reply again.
+            is_new_connection = not (
+                self.is_connected
+                and self.address == client_address
+                and self.init_id == id
             )
-            if is_header_corrupted:  # The header is corrupted. It can not be parsed.
-                continue
-            computed_checksum = self.compute_checksum(type, id, length, data)
-            # The checksum is not equal to the computed checksum.
-            # The message is corrupted.
-            if computed_checksum != checksum:
-                continue
-            if type == "i" and self.is_server:
-                with self.mutex:
-                    self.is_connected = True
-                    self.close_flag = False
-                    self.is_close_sent = False
-                    self.sending_ended = False
-                    self.address = client_address
-                    self.id = 0
-                    checksum = self.compute_checksum("s", id, 0, "")
-                    ack = self.message_formatter("s", id, 0, checksum, "")
-                    self._send(ack, client_address)
-                    print(f"Connected from {self.address}")
-
-            elif type == "s" and not self.is_server:
-                with self.mutex:
-                    self.is_connected = True
-                    self.init_condition.notify()
-                    timer = self.timers.pop(id, None)
-                    if timer:
-                        timer.cancel()
-
-            elif type == "a":
-                with self.mutex:
-                    self.ack_handler(id)
+            if is_new_connection:
+                self.is_connected = True
+                self.close_flag = False
+                self.is_close_sent = False
+                self.sending_ended = False
+                self.address = client_address
+                self.init_id = id
+                self.negotiate(HANDSHAKE_OFFER.unpack(data))
+                self.isn = random_sequence_number()
+                self.id = self.isn
+                self.recv_next = seq_add(id, 1)
+                self.recv_blocks = []
+                self.reorder_buffer = {}
+                self.unacked_segments = 0
+                self.peer_ack = self.id
+                self.congestion_controller = create_congestion_controller(
+                    self.congestion_control, self.window_size
+                )
+                self.recovery_point = None
+                self.is_timeout_recovery = False
+                print(f"Connected from {self.address}")
+            data = HANDSHAKE_REPLY.pack(
+                self.isn,
+                self.max_segment_size,
+                self.receive_window_size,
+                self.checksum.code,
+                self.features,
+            )
+            checksum = self.compute_checksum("s", id, len(data), data)
+            ack = self.message_formatter("s", id, len(data), checksum, data)
+            self._send(ack, client_address)
+            if is_new_connection:
+                self.start_path_mtu_discovery()
+
+        elif type == "s" and not self.is_server:
+            if length != HANDSHAKE_REPLY.size:
+                return False
+            # The first reply gives the initial sequence number of
+            # the server, the connection ID and the agreed parameters.
+            if not self.is_connected:
+                (
+                    self.recv_next,
+                    self.max_segment_size,
+                    self.peer_window,
+                    checksum_code,
+                    features,
+                ) = HANDSHAKE_REPLY.unpack(data)
+                self.connection_id = connection_id
+                self.checksum = CHECKSUMS_BY_CODE.get(checksum_code, self.checksum)
+                self.features = features & self.offered_features
+                self.start_path_mtu_discovery()
+            self.is_connected = True
+            self.init_condition.notify()
+            self.ack_handler(id)
+
+        elif type == "a":
+            if length < ACK_WINDOW.size or (length - ACK_WINDOW.size) % SACK_BLOCK.size:
+                return False
+            (window,) = ACK_WINDOW.unpack_from(data)
+            sack_blocks = SACK_BLOCK.iter_unpack(data[ACK_WINDOW.size :])
+            self.cumulative_ack_handler(id, window, sack_blocks)
+            self.sending_condition.notify()
+            self.check_closed()
+
+        elif type in "dzmDZM":
+            if type in "DZM":
+                if length < PIGGYBACK_ACK.size:
+                    return False
+                # A retransmitted segment carries an old ack, only an ack
+                # that moves forward is handled.
+                ack, window = PIGGYBACK_ACK.unpack_from(data)
+                if seq_before(self.peer_ack, ack):
+                    self.cumulative_ack_handler(ack, window, [])
                     self.sending_condition.notify()
+                    self.check_closed()
+                data = data[PIGGYBACK_ACK.size :]
+            if type in "zZ":
+                data = self.decompress(data)
+                if data is None:
+                    return False
+            elif type in "mM":
+                data = self.unpack_messages(data)
+                if data is None:
+                    return False
+            # An in-order segment is acked late unless it fills a gap, the
+            # other segments are acked at once.
+            recv_next = self.recv_next
+            has_gaps = bool(self.recv_blocks)
+            block = self.receive_data(id, data, client_address)
+            if recv_next != self.recv_next and not has_gaps:
+                self.delay_ack()
+            else:
+                self.send_ack(block)
+            # A segment that was missing before the close message may let the
+            # server ack the close message.
+            if self.close_flag:
+                self.check_closed()
+            # The buffer of a compressed or coalesced message is not kept,
+            # its decompressed payload or its messages are.
+            return type in "dD"
 
-                    if (
-                        not self.is_server
-                        and self.close_flag
-                        and self.is_close_sent
-                        and len(self.timers.keys()) == 0
-                    ):
-                        self.close_condition.notify()
-                        return
-                    elif (
-                        self.is_server
-                        and self.close_flag
-                        and self.sending_ended
-                        and len(self.timers.keys()) == 0
-                    ):
-                        checksum = self.compute_checksum("a", self.close_id, 0, "")
-                        ack = self.message_formatter(
-                            "a", self.close_id, 0, checksum, ""
-                        )
-                        self._send(ack, self.address)
-
-            elif type == "d":
-                with self.mutex:
-                    self.recv_buffer.append((data, client_address))
-                    self.recv_condition.notify()
-                    checksum = self.compute_checksum("a", id, 0, "")
-                    ack = self.message_formatter("a", id, 0, checksum, "")
-                    self._send(ack, self.address)
-
-            elif type == "c":
-                with self.mutex:
-                    if self.is_server:
-                        self.close_flag = True
-                        self.close_id = id
-                        self.sending_condition.notify()
-
-                    if (
-                        self.is_server
-                        and self.close_flag
-                        and self.sending_ended
-                        and len(self.timers.keys()) == 0
-                    ):
-                        checksum = self.compute_checksum("a", self.close_id, 0, "")
-                        ack = self.message_formatter(
-                            "a", self.close_id, 0, checksum, ""
-                        )
-                        self._send(ack, self.address)
+        elif type == "w":
+            self.send_ack()
+
+        elif type == "p":
+            checksum = self.compute_checksum("q", id, 0, b"")
+            ack = self.message_formatter("q", id, 0, checksum, b"")
+            self._send(ack, client_address)
+
+        elif type == "q":
+            self.path_probe_ack_handler(id)
+
+        elif type == "c":
+            if self.is_server:
+                with self.send_buffer_lock:
+                    self.close_flag = True
+                self.close_id = id
+                self.stop_path_mtu_discovery()
+                self.sending_condition.notify()
+            self.check_closed()
+        return False
+
+    def check_closed(self):
+        """
+        This function finishes the close procedure once every message is
+        acked: the client sends its close message once its data is acked and
+        stops after the ack of the close message, the server acks the close
+        message after its data is sent and every segment before the close
+        message is received.
+        """
+        if (
+            not self.is_server
+            and self.close_flag
+            and len(self.waiting_for_ack_buffer) == 0
+        ):
+            if self.is_close_sent:
+                self.close_condition.notify()
+                self.sending_condition.notify()
+                self.exit_flag = True
+                with self.recv_lock:
+                    self.recv_condition.notify_all()
+            elif len(self.send_buffer) == 0:
+                self.close_condition.notify()
+        elif (
+            self.is_server
+            and self.close_flag
+            and self.sending_ended
+            and len(self.waiting_for_ack_buffer) == 0
+            and self.recv_next == self.close_id
+        ):
+            self.send_close_ack()
+
+    def start_path_mtu_discovery(self):
+        """
+        This function sizes the segments to fit the base datagram size and
+        starts the search of the path MTU if the datagrams are sent with the
+        don't fragment bit. It is called when the connection is established.
+        """
+        overhead = HEADER.size + self.checksum.size
+        self.segment_size = min(self.max_segment_size, BASE_DATAGRAM_SIZE - overhead)
+        self.path_search = None
+        if self.is_dont_fragment:
+            self.path_search = PathMTUSearch(self.max_segment_size + overhead)
+            self.send_path_probe()
+
+    def send_path_probe(self):
+        """
+        This function sends the next probe of the path MTU search and starts
+        its timer. The search ends when no size is left to probe or the
+        connection is closing.
+        """
+        if self.path_search is None:
+            return
+        size = None if self.close_flag else self.path_search.next_probe()
+        if size is None:
+            self.stop_path_mtu_discovery()
+            return
+        data = bytes(size - HEADER.size - self.checksum.size)
+        checksum = self.compute_checksum("p", size, len(data), data)
+        probe = self.message_formatter("p", size, len(data), checksum, data)
+        self._send(probe, self.address)
+        self.timers.arm(PMTU_TIMER, self.timer_interval)
+
+    def path_probe_ack_handler(self, size):
+        """
+        This function handles the ack of a path MTU probe. The segments grow
+        to fit the acked datagram size and the next probe is sent.
+        """
+        if self.path_search is None or not self.path_search.on_ack(size):
+            return
+        self.segment_size = max(
+            self.segment_size,
+            min(self.max_segment_size, size - HEADER.size - self.checksum.size),
+        )
+        self.send_path_probe()
+
+    def stop_path_mtu_discovery(self):
+        """
+        This function ends the search of the path MTU. The segments keep the
+        largest size found.
+        """
+        self.path_search = None
+        self.timers.cancel(PMTU_TIMER)
+
+    def decompress(self, data):
+        """
+        This function returns the payload of a compressed data message as a
+        memoryview, or None if it is not a valid zlib stream or it is larger
+        than the largest payload of the connection.
+        """
+        decompressor = zlib.decompressobj()
+        try:
+            payload = decompressor.decompress(data, self.max_segment_size)
+        except zlib.error:
+            return None
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            return None
+        return memoryview(payload)
+
+    def send_close_ack(self):
+        """
+        This function acks the close message. It is sent once every data
+        segment before the close message is received, so the cumulative ack is
+        the segment after it.
+        """
+        ack = seq_add(self.close_id, 1)
+        data = ACK_WINDOW.pack(self.receive_window())
+        checksum = self.compute_checksum("a", ack, len(data), data)
+        msg = self.message_formatter("a", ack, len(data), checksum, data)
+        self._send(msg, self.address)
+
+    def abort(self):
+        """
+        This function closes the connection without the close procedure, when
+        the other end stops responding. It is called with the mutex held. The
+        messages not yet acked are dropped, the timers stop and every waiter
+        is woken up: the senders are refused and the readers are told that the
+        connection is closed once they read what is left.
+        """
+        self.exit_flag = True
+        with self.send_buffer_lock:
+            self.close_flag = True
+            self.send_buffer.clear()
+            self.send_buffer_bytes = 0
+            self.writable_condition.notify_all()
+        self.waiting_for_ack_buffer.clear()
+        self.lost_messages.clear()
+        self.timers.stop()
+        self.init_condition.notify()
+        self.close_condition.notify()
+        self.sending_condition.notify()
+        with self.recv_lock:
+            self.recv_condition.notify_all()
 
     def close(self):
         """
         This function is called by the upper layer in the client to close the connection.
 
         It sets the close flag to True and notifies the sending condition. It waits
-        for the close condition to be notified. It sends a close message and waits
-        for an ack. If the ack is not received within a certain time, the message
-        is resent.
+        until the send buffer is sent and every data segment is acked, so the
+        ack of the close message never stands for a lost segment. It sends a
+        close message and waits for an ack. If the ack is not received within a
+        certain time, the message is resent. Nothing is sent if the connection
+        is aborted meanwhile.
         """
         with self.mutex:
-            self.close_flag = True
+            # The close flag is set with the lock of the send buffer, so a
+            # message is either queued before it or refused.
+            with self.send_buffer_lock:
+                self.close_flag = True
+            self.stop_path_mtu_discovery()
             self.sending_condition.notify()
 
-            self.close_condition.wait()
+            # The messages are taken from the send buffer with the mutex held,
+            # so it is read without the lock of the send buffer.
+            while (
+                self.send_buffer or self.waiting_for_ack_buffer
+            ) and not self.exit_flag:
+                self.close_condition.wait()
+            if self.exit_flag:
+                return
             id = self.id
-            checksum = self.compute_checksum("c", id, 0, "")
-            msg = self.message_formatter("c", id, 0, checksum, "")
+            checksum = self.compute_checksum("c", id, 0, b"")
+            msg = self.message_formatter("c", id, 0, checksum, b"")
             self.waiting_for_ack_buffer[id] = msg
-            timer = threading.Timer(self.timer_interval, self.resend, [id])
-            timer.start()
-            self.timers[id] = timer
+            self.start_timer(id)
 
-            self.id += 1
-            if self.id > self.max_sequence_number:
-                self.id = 0
+            self.id = seq_add(self.id, 1)
 
             self._send(msg, self.address)
 
             self.is_close_sent = True
 
-            self.close_condition.wait()
+            self.flush_locked()
+            while not self.exit_flag:
+                self.close_condition.wait()
+            self.timers.stop()
 
     def _send(self, msg, address):
         """
-        Sends a message to the specified address. This function is called
-        internally by the class.
+        Queues a message to be sent to the specified address. This function is
+        called internally by the class with the mutex held.
+
+        The queued messages are sent in a batch by flush once the mutex is
+        released.
+        """
+        self.outgoing.append((msg, address))
 
-        It sends data using udp sockets.
+    def flush(self):
+        """
+        This function sends the queued messages in a batch. It is called
+        without the mutex, so the system calls do not hold up the other
+        threads.
         """
-        self.sock.sendto(msg.encode("utf-8"), address)
+        if not self.outgoing:
+            return
+        with self.send_lock:
+            with self.mutex:
+                datagrams = self.outgoing
+                self.outgoing = []
+            if datagrams:
+                self.io.send(datagrams)
 
-    def send(self, msg, address):
+    def flush_locked(self):
+        """
+        This function sends the queued messages in a batch. It is called with
+        the mutex held and releases it while the messages are sent.
+        """
+        self.mutex.release()
+        try:
+            self.flush()
+        finally:
+            self.mutex.acquire()
+
+    def send(self, msg, address, block=True, timeout=None):
         """
         This function is called by the upper layer to send data to the network.
+        It waits for room in the send buffer as send_many does. It returns
+        False if the connection is closing.
         """
-        with self.mutex:
-            if not self.close_flag:
-                self.address = address
-                self.send_buffer.append(msg)
-                self.sending_condition.notify()
-                return True
-            else:
-                return False
+        return self.send_many([msg], address, block, timeout) == 1
 
-    def send_many(self, msgs, address):
-        with self.mutex:
-            if not self.close_flag:
+    def send_many(self, msgs, address, block=True, timeout=None):
+        """
+        This function is called by the upper layer to send a list of messages
+        to the network. It raises ValueError if a message is larger than the
+        segment size.
+
+        The messages are appended to the send buffer as it has room for them.
+        A blocking call waits for room, for at most timeout seconds if it is
+        given. A non-blocking call appends the messages that fit.
+
+        It returns the number of appended messages, fewer than the messages
+        only if the call does not block or times out, or False if the
+        connection is closing. It raises BlockingIOError or socket.timeout if
+        no message could be appended.
+
+        Only the lock of the send buffer is held, never the mutex, so a large
+        batch does not hold up the acks and the retransmissions.
+        """
+        self.check_segment_size(msgs)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.send_buffer_lock:
+            queued = 0
+            while True:
+                if self.close_flag:
+                    return queued or False
                 self.address = address
-                for msg in msgs:
-                    self.send_buffer.append(msg)
-                self.sending_condition.notify()
-                return True
-            else:
-                return False
+                queued += self.queue_messages(msgs, queued)
+                if queued == len(msgs):
+                    return queued
+
+                self.is_send_blocked = True
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    if queued:
+                        return queued
+                    if not block:
+                        raise BlockingIOError(
+                            errno.EWOULDBLOCK, "the send buffer is full"
+                        )
+                    raise socket.timeout("timed out")
+                self.writable_condition.wait(remaining)
+
+    def check_segment_size(self, msgs):
+        """
+        This function raises ValueError if a message is larger than the largest
+        payload that fits the path MTU. The datagrams are not fragmented, so
+        such a message would never reach the other end.
+        """
+        for msg in msgs:
+            if len(msg) > self.segment_size:
+                raise ValueError(
+                    f"message of {len(msg)} bytes is larger than the "
+                    f"segment size {self.segment_size}"
+                )
 
     def recv(self):
         """
         This function is called by the upper layer to receive data from the
-        network. It blocks until data is received.
+        network. It blocks until data is received. Data is received in the
+        order it is sent.
+
+        If the receive window advertised to the other end was below half of the
+        receive buffers and reading the data opens it above half, the new
+        window is advertised at once. Only then is the mutex acquired.
+        """
+        with self.recv_lock:
+            message, address = self.recv_view_locked()
+        self.update_receive_window()
+        data = bytes(message)
+        self.buffer_pool.release(message.obj)
+        return data, address
+
+    def recv_view(self):
+        """
+        This function is called by the upper layer to receive data from the
+        network without copying it. It blocks until data is received and
+        returns a memoryview of the receive buffer that holds the data.
+
+        The view is valid until it is given back with release_view.
         """
+        with self.recv_lock:
+            message, address = self.recv_view_locked()
+        self.update_receive_window()
+        return message, address
+
+    def recv_view_locked(self):
+        """
+        This function waits for the next received message and takes it from
+        the receive buffer. It is called with the receive lock held, not the
+        mutex. It raises ConnectionError if the connection is closed and
+        nothing is left to read.
+        """
+        while len(self.recv_buffer) == 0:
+            if self.exit_flag:
+                raise ConnectionError("the connection is closed")
+            self.recv_condition.wait()
+        return self.recv_buffer.popleft()
+
+    def take_received(self):
+        """
+        This function takes the next received message from the receive buffer,
+        which must not be empty, and advertises the window if it opened.
+        """
+        message, address = self.recv_buffer.popleft()
+        self.update_receive_window()
+        return message, address
+
+    def is_window_update_due(self):
+        """
+        This function returns whether the receive window advertised to the
+        other end was below half of the receive buffers and is above half now.
+        """
+        return (
+            self.advertised_window < self.receive_window_size // 2
+            and self.receive_window() >= self.receive_window_size // 2
+        )
+
+    def update_receive_window(self):
+        """
+        This function advertises the receive window after a message is taken
+        from the receive buffer, if it opened above half of the receive
+        buffers. It is called without the mutex, which is acquired only to
+        send the ack.
+        """
+        if not self.is_window_update_due():
+            return
         with self.mutex:
-            while len(self.recv_buffer) == 0:
-                self.recv_condition.wait()
-            message, address = self.recv_buffer.pop(0)
-            return message, address
+            if self.is_window_update_due():
+                self.send_ack()
+        self.flush()
+
+    def release_view(self, message):
+        """
+        This function gives the buffer of a message returned by recv_view back
+        to the buffer pool.
+        """
+        self.buffer_pool.release(message.obj)
 
     def message_formatter(self, type, id, length, checksum, data):
         """
         This function formats the message to be sent over the network.
+        It packs the header fields and appends the checksum and the raw
+        payload bytes.
         """
-        message = (
-            f"type:{type}\nid:{id}\nlength:{length}\nchecksum:{checksum}\n\n{data}"
+        header = HEADER.pack(
+            WIRE_VERSION, ord(type), self.checksum.code, self.connection_id, id, length
         )
-        return message
+        return b"".join((header, checksum, data))
 
     def message_parser(self, message):
         """
         This function parses the message received from the network and returns
-        the type, sequence number, length and data.
+        the type, connection ID, sequence number, length, checksum type,
+        checksum and data.
+        The checksum and the data are views of the message, they are not copied.
+
+        The header is corrupted if the message is shorter than the header, the
+        version or the checksum type is unknown or the payload length does not
+        match the header.
         """
         is_header_corrupted = False
         try:
-            parts = message.split("\n\n")
-            header = parts[0]
-            header_parts = header.split("\n")
-            type = header_parts[0].split(":")[1]
-            id = int(header_parts[1].split(":")[1])
-            length = int(header_parts[2].split(":")[1])
-            checksum = header_parts[3].split(":")[1]
-            if len(parts) > 1 and len(parts[1]) > 0:
-                data = ast.literal_eval(parts[1])
-            else:
-                data = ""
-        except Exception as e:
+            version, type, code, connection_id, id, length = HEADER.unpack_from(message)
+            checksum_type = CHECKSUMS_BY_CODE.get(code)
+            if version != WIRE_VERSION or checksum_type is None:
+                raise ValueError("malformed segment")
+            checksum_end = HEADER.size + checksum_type.size
+            checksum = message[HEADER.size : checksum_end]
+            data = message[checksum_end:]
+            if length != len(data):
+                raise ValueError("malformed segment")
+            type = chr(type)
+        except (struct.error, ValueError):
             is_header_corrupted = True
             type = None
+            connection_id = None
             id = None
             length = None
+            checksum_type = None
             checksum = None
             data = None
-        return type, id, length, checksum, data, is_header_corrupted
+        return (
+            type,
+            connection_id,
+            id,
+            length,
+            checksum_type,
+            checksum,
+            data,
+            is_header_corrupted,
+        )
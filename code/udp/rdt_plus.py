@@ -3,14 +3,46 @@ This module implements RDT+ protocol. It is using RDT protocol as a base.
 RDT+ protocol is used to send multiple objects over the network.
 
 It receives a list of objects, split them into segments, interleave them and send them over the network.
+The segments are generated while the send buffer of RDT has room for them.
 
 It also receives segments, reorder them and construct the original object.
+
+Objects larger than memory are streamed: send_stream reads an object from a
+file or an iterable while it is sent, and recv_stream yields the data of the
+objects in order as it is received.
 """
 
-from rdt import RDT
-import ast
+from rdt import RDT, CONGESTION_CONTROL, CHECKSUM, FEATURES, PACING
+from listener import RDTListener
+from reassembly import (
+    ObjectReassembly,
+    CompletedObjects,
+    segments_count,
+    fits_reassembly,
+    COMPLETED_WINDOW,
+    MAX_OBJECT_SIZE,
+    MAX_REASSEMBLY_BYTES,
+)
+from scheduler import create_scheduler
+from collections import deque
+import struct
+import time
 
-MAX_SEGMENT_SIZE = 2048
+# Every RDT+ segment starts with a binary header followed by the raw bytes of
+# the segment: object id (4 bytes), size of the object (8 bytes), size of the
+# segments of the object but the last (4 bytes) and segment id (4 bytes). The
+# segment is at offset segment id * segment size of the object.
+SEGMENT_HEADER = struct.Struct("!IQII")
+# The number of messages that are generated and handed to RDT at once. The
+# next messages are generated when the send buffer of RDT has room for them,
+# so the send buffer bounds the data generated ahead of the network.
+SEND_BATCH_SIZE = 64
+# The name of the object scheduler that interleaves the segments of the objects
+# sent together: "rr" (round robin), "srf" (shortest remaining first) or "wfq"
+# (weighted fair queuing).
+SCHEDULER = "rr"
+# The number of completed objects whose completion time is kept.
+COMPLETIONS_SIZE = 1024
 
 
 class RDTPlus:
@@ -21,159 +53,448 @@ class RDTPlus:
     It implements invervalve and reordering of segments.
     """
 
-    def __init__(self, sock, is_server=True, server_address_port=None):
+    def __init__(
+        self,
+        sock,
+        is_server=True,
+        server_address_port=None,
+        congestion_control=CONGESTION_CONTROL,
+        checksum=CHECKSUM,
+        features=FEATURES,
+        pacing=PACING,
+        scheduler=SCHEDULER,
+    ):
         """
         This method initializes RDT+ protocol.
-        It receives a socket, is_server flag and server_address_port.
+        It receives a socket, is_server flag, server_address_port, the names
+        of the congestion control algorithm and of the checksum, the features
+        and the pacing of the underlying RDT connection and the name of the
+        object scheduler.
         If is_server is True, server_address_port should be None.
         If is_server is False, server_address_port should be the address of the server.
 
-        It initializes the send_obj_id, recv_objects and recv_objects_ids attributes.
+        It initializes the send_obj_id, recv_objects, completed_objects and stream_objects attributes.
         The send_obj_id is used to identify the objects that are sent or received.
-        The recv_objects is a dictionary that contains the objects that are received.
-        The recv_objects_ids is a list of the ids of the objects that are received.
-        The completed_objects_ids is a list of the ids of the objects that are completed.
+        The recv_objects is a dictionary of the reassembly of the objects that are received.
+        The completed_objects records the ids of the objects that are completed, in bounded memory.
+        The stream_objects is a dictionary of the objects that are streamed by recv_stream.
+        The completions is a queue of the (obj_id, size, start time, completion time) of the last completed objects.
+        The max_object_size is the largest object that recv reassembles, the segments of larger objects are dropped.
+        The max_reassembly_bytes bounds the size of the objects that recv reassembles at once, reassembly_bytes is their size.
         """
-        self.rdt = RDT(sock, is_server, server_address_port)
+        # The scheduler is checked before the connection is made.
+        create_scheduler(scheduler)
+        rdt = RDT(
+            sock,
+            is_server,
+            server_address_port,
+            congestion_control,
+            checksum,
+            features,
+            pacing,
+        )
+        self._init_plus_state(rdt, scheduler)
         if not is_server:
             if server_address_port is None:
                 raise ValueError("server_address_port cannot be None")
             self.rdt.initialize_connection()
-        self.send_obj_id = 0
-        self.recv_objects = {}
-        self.recv_objects_ids = []
-        self.completed_objects_ids = []
 
-    def send(self, msgs: list, address_port):
+    @classmethod
+    def from_connection(cls, rdt, scheduler=SCHEDULER):
+        """
+        This method creates RDT+ protocol over an RDT connection that is
+        already established, such as a connection accepted by a listener.
+        """
+        rdt_plus = cls.__new__(cls)
+        rdt_plus._init_plus_state(rdt, scheduler)
+        return rdt_plus
+
+    def _init_plus_state(self, rdt, scheduler):
+        """
+        This method initializes the state of RDT+ protocol over an RDT
+        connection with the name of the object scheduler. Every way of
+        creating RDT+ protocol calls it, the state of the objects is reset by
+        cleanup_server.
+        """
+        create_scheduler(scheduler)
+        self.rdt = rdt
+        self.scheduler = scheduler
+        self.max_object_size = MAX_OBJECT_SIZE
+        self.max_reassembly_bytes = MAX_REASSEMBLY_BYTES
+        self.cleanup_server()
+
+    def send(self, msgs: list, address_port, priorities=None, weights=None):
         """
         This method sends a list of objects over the network.
         It receives a list of objects and the address of the receiver.
         It splits the objects into segments, interleave them and send them over the network.
+        It waits while the send buffer of the connection is full.
+
+        The segments are interleaved by the object scheduler of the connection.
+        priorities and weights are optional lists with a value per object: the
+        objects of a higher priority are sent first, and weighted fair queuing
+        shares the segments in proportion to the weights. It raises ValueError
+        before anything is sent if they do not match the objects.
+
+        The messages are generated in batches as the send buffer has room for
+        them, so the first segments are sent at once whatever the size of the
+        objects.
         """
-        send_objects_dic = {}
-        for msg in msgs:
-            if msg is None:
-                continue
-            elif len(msg) > MAX_SEGMENT_SIZE:
-                segments = self._split_msg(msg)
-                segments_num = len(segments)
-            else:
-                segments = [msg]
-                segments_num = 1
+        messages = self._segment_objects(msgs, priorities, weights)
+        for batch in self._batch_messages(messages):
+            self.rdt.send_many(batch, address_port)
 
-            send_objects_dic[self.send_obj_id] = [segments, segments_num, 0]
-            self.send_obj_id += 1
+    def send_stream(self, obj_id, source, size, address_port=None):
+        """
+        This method sends an object of size bytes that is read while it is
+        sent, so the object does not need to fit in memory. The source is a
+        file object opened in binary mode or an iterable of bytes-like chunks
+        of any size. The object is sent to the address of the connection
+        unless address_port is given.
 
-        messages = self._construct_messages(send_objects_dic)
-        self.rdt.send_many(messages, address_port)
+        The object id must not be used by another object of the connection,
+        the ids of the objects sent with send come after it.
+        It waits while the send buffer of the connection is full.
+        It raises ValueError if the object id is invalid or the source does
+        not hold size bytes.
+        """
+        self._check_stream_id(obj_id)
+        if address_port is None:
+            address_port = self.rdt.address
+        messages = self._stream_messages(obj_id, source, size)
+        for batch in self._batch_messages(messages):
+            self.rdt.send_many(batch, address_port)
 
-    def _split_msg(self, msg):
+    def _check_stream_id(self, obj_id):
         """
-        This method splits a message into segments.
-        It receives a message and split it into segments.
-        It returns a list of segments.
+        This method raises ValueError if the id of a streamed object is before
+        the next id of the connection, the receiver would drop its segments as
+        the segments of a completed object, or if it is so far after it that
+        the receiver would give up the objects still in flight.
         """
-        segments = []
-        while msg:
-            segments.append(msg[:MAX_SEGMENT_SIZE])
-            msg = msg[MAX_SEGMENT_SIZE:]
-        return segments
+        if obj_id < self.send_obj_id:
+            raise ValueError(
+                f"object id {obj_id} is already used, the next id is {self.send_obj_id}"
+            )
+        if obj_id >= self.send_obj_id + COMPLETED_WINDOW:
+            raise ValueError(
+                f"object id {obj_id} is too far after the next id {self.send_obj_id}"
+            )
 
-    def _construct_messages(self, objects_dic):
+    def _batch_messages(self, messages):
         """
-        This method constructs messages from segmented objects.
-        It receives a dictionary of objects.
-        It returns a list of messages that are constructed from interleved segments of objects.
-        """
-        messages = []
-        is_still_remaning_segments_to_send = True
-        while is_still_remaning_segments_to_send:
-            is_still_remaning_segments_to_send = False
-            for obj_id, obj in objects_dic.items():
-                segments, segments_num, segments_sent = obj
-                if segments_sent < segments_num:
-                    is_still_remaning_segments_to_send = True
-                    msg_to_send = (
-                        f"obj_id:{obj_id}\nsegments_num:{segments_num}\nsegment_id:{segments_sent}\n\n"
-                        + str(segments[segments_sent])
-                    )
-
-                    msg_to_send = msg_to_send.encode("utf-8")
-                    messages.append(msg_to_send)
-                    objects_dic[obj_id] = (
-                        segments,
-                        segments_num,
-                        segments_sent + 1,
-                    )
-
-        return messages
+        This method returns an iterator of the lists of the messages of an
+        iterator, at most SEND_BATCH_SIZE messages in a list. A list is
+        generated when the previous one is handed to RDT.
+        """
+        batch = []
+        for message in messages:
+            batch.append(message)
+            if len(batch) == SEND_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
-    def _parse_msg(self, msg):
+    def _stream_messages(self, obj_id, source, size):
+        """
+        This method reads a streamed object from its source and returns an
+        iterator of its messages.
+
+        The segments are sized when the stream starts, their size does not
+        change if the segment size of the connection grows.
+        """
+        segment_size = self._segment_size()
+        self.send_obj_id = max(self.send_obj_id, obj_id + 1)
+
+        segment_id = 0
+        sent = 0
+        for segment in self._read_segments(source, segment_size):
+            sent += len(segment)
+            if sent > size:
+                raise ValueError(f"the source of object {obj_id} is longer than {size}")
+            yield b"".join(
+                (SEGMENT_HEADER.pack(obj_id, size, segment_size, segment_id), segment)
+            )
+            segment_id += 1
+        if sent < size:
+            raise ValueError(
+                f"the source of object {obj_id} ended after {sent} of {size} bytes"
+            )
+        if size == 0:
+            yield SEGMENT_HEADER.pack(obj_id, 0, segment_size, 0)
+
+    def _read_segments(self, source, segment_size):
+        """
+        This method returns an iterator of the segments of a source of a
+        streamed object, every segment but the last of segment_size bytes.
+        The chunks of the source are sliced without copying, only a segment
+        that spans chunks is copied.
+        """
+        if hasattr(source, "read"):
+            read = source.read
+            source = iter(lambda: read(segment_size), b"")
+        pending = bytearray()
+        for chunk in source:
+            view = memoryview(chunk).cast("B")
+            if pending:
+                needed = segment_size - len(pending)
+                pending += view[:needed]
+                view = view[needed:]
+                if len(pending) < segment_size:
+                    continue
+                yield bytes(pending)
+                pending.clear()
+            while len(view) >= segment_size:
+                yield view[:segment_size]
+                view = view[segment_size:]
+            pending += view
+        if pending:
+            yield bytes(pending)
+
+    def _segment_objects(self, msgs, priorities=None, weights=None):
+        """
+        This method assigns the ids of a list of objects and adds them to a
+        new scheduler. It returns an iterator of the interleaved messages of
+        their segments, which are generated as they are read.
+
+        It raises ValueError if priorities or weights do not have a value per
+        object or a weight is not positive. No id is assigned then.
         """
-        This method parses a message.
+        for name, values in (("priorities", priorities), ("weights", weights)):
+            if values is not None and len(values) != len(msgs):
+                raise ValueError(f"{len(values)} {name} given for {len(msgs)} objects")
+        send_objects_dic = {}
+        scheduler = create_scheduler(self.scheduler)
+        segment_size = self._segment_size()
+        obj_id = self.send_obj_id
+        for index, msg in enumerate(msgs):
+            if msg is None:
+                continue
+            send_objects_dic[obj_id] = [
+                memoryview(msg).cast("B"),
+                segment_size,
+                0,
+            ]
+            scheduler.add(
+                obj_id,
+                segments_count(len(msg), segment_size),
+                priorities[index] if priorities is not None else 0,
+                weights[index] if weights is not None else 1,
+            )
+            obj_id += 1
+        self.send_obj_id = obj_id
+
+        return self._construct_messages(send_objects_dic, scheduler)
+
+    def _segment_size(self):
         """
-        msg = msg.split("\n\n")
-        header = msg[0].split("\n")
-        body = msg[1]
-        obj_id = int(header[0].split(":")[1])
-        segments_num = int(header[1].split(":")[1])
-        segment_id = int(header[2].split(":")[1])
+        This method returns the largest segment of an object that fits in an
+        RDT segment of the connection along with its RDT+ header. The RDT
+        segment size fits the path MTU, so the segments are not fragmented.
+        """
+        return self.rdt.segment_size - SEGMENT_HEADER.size
 
-        return obj_id, segments_num, segment_id, body
+    def _construct_messages(self, objects_dic, scheduler):
+        """
+        This method constructs messages from segmented objects.
+        It receives a dictionary of objects and the scheduler that holds them.
+        It returns an iterator of the messages that are constructed from interleved segments of objects,
+        in the order chosen by the scheduler.
+        A segment is a view of its object, it is copied once into its message
+        when the message is generated.
+        """
+        obj_id = scheduler.next()
+        while obj_id is not None:
+            obj = objects_dic[obj_id]
+            view, segment_size, segments_sent = obj
+            start = segments_sent * segment_size
+            yield b"".join(
+                (
+                    SEGMENT_HEADER.pack(obj_id, len(view), segment_size, segments_sent),
+                    view[start : start + segment_size],
+                )
+            )
+            obj[2] = segments_sent + 1
+            if obj[2] == segments_count(len(view), segment_size):
+                del objects_dic[obj_id]
+            obj_id = scheduler.next()
 
-    def _construct_object(self, obj_id):
+    def _parse_msg(self, msg):
         """
-        This method constructs an object from segments.
-        It receives an object id and construct the object from segments.
-        It returns the object.
+        This method parses a message. It returns the object id, the size of
+        the object, the size of its segments, the segment id and the body, or
+        None if the message is malformed.
         """
-        segments, segments_num, address, segments_recv = self.recv_objects[obj_id]
-        object = ""
-        ## order segments
-        segments.sort(key=lambda x: x[0])
-        for segment in segments:
-            object += segment[1]
+        if len(msg) < SEGMENT_HEADER.size:
+            return None
+        obj_id, size, segment_size, segment_id = SEGMENT_HEADER.unpack_from(msg)
+        if segment_size == 0:
+            return None
+        body = msg[SEGMENT_HEADER.size :]
 
-        return object
+        return obj_id, size, segment_size, segment_id, body
 
     def recv(self):
         """
         This method receives a list of objects over the network.
 
         It stores the objects in recv_objects dictionary.
+        The segments are read from the receive buffers of RDT without copying,
+        the body of a new segment is copied once, to its offset in the buffer
+        of its object.
 
-        If an object is completed, it constructs the object and return it along with the sender address.
+        If an object is completed, it returns the object along with the sender address.
+        The object is returned as a bytearray, the buffer it is reassembled in.
         """
         while True:
-            msg, address = self.rdt.recv()
-            msg = msg.decode("utf-8")
-            obj_id, segments_num, segment_id, body = self._parse_msg(msg)
-
-            if obj_id in self.completed_objects_ids:
-                continue
-            elif obj_id in self.recv_objects_ids:
-                if segment_id in [x[0] for x in self.recv_objects[obj_id][0]]:
-                    continue
-                self.recv_objects[obj_id][0].append((segment_id, body))
-                self.recv_objects[obj_id][3] += 1
-
-            else:
-                self.recv_objects_ids.append(obj_id)
-                self.recv_objects[obj_id] = [
-                    [(segment_id, body)],
-                    segments_num,
-                    address,
-                    1,
-                ]
-
-            if self.recv_objects[obj_id][3] == segments_num:
-                self.completed_objects_ids.append(obj_id)
-                self.recv_objects_ids.remove(obj_id)
-                object = self._construct_object(obj_id)
-                self.recv_objects.pop(obj_id)
-                object = ast.literal_eval(object)
+            msg, address = self.rdt.recv_view()
+            object = self._receive_segment(msg, address)
+            if object is not None:
                 return object, address
 
+    def recv_stream(self):
+        """
+        This method receives the objects over the network as streams. It
+        yields (obj_id, data, is_last, address) tuples, the data of every
+        object in order and as soon as it is contiguous, so an object is
+        processed while it is received and never held in memory as a whole.
+        is_last is True for the last data of an object. The data of different
+        objects may be interleaved.
+
+        It ends when the connection is closed. It must not be used together
+        with recv on the same connection.
+        """
+        while True:
+            try:
+                msg, address = self.rdt.recv_view()
+            except ConnectionError:
+                return
+            yield from self._receive_stream_segment(msg, address)
+
+    def _receive_stream_segment(self, msg, address):
+        """
+        This method handles a segment received from RDT by recv_stream and
+        gives its view back. It returns the list of the data of the object
+        that became contiguous, as tuples yielded by recv_stream.
+
+        The segments of an object are received in order unless the sender
+        interleaves them otherwise, the segments after a gap wait for it.
+        """
+        try:
+            parsed = self._parse_msg(msg)
+            if parsed is None:
+                return []
+            obj_id, size, segment_size, segment_id, body = parsed
+            if obj_id in self.completed_objects:
+                return []
+            body = bytes(body)
+        finally:
+            self.rdt.release_view(msg)
+        segments_num = segments_count(size, segment_size)
+
+        if obj_id not in self.stream_objects:
+            self.stream_objects[obj_id] = [0, {}, time.monotonic()]
+        next_segment_id, pending, start_time = self.stream_objects[obj_id]
+        if segment_id < next_segment_id or segment_id in pending:
+            return []
+        pending[segment_id] = body
+
+        chunks = []
+        while next_segment_id in pending:
+            body = pending.pop(next_segment_id)
+            next_segment_id += 1
+            chunks.append((obj_id, body, next_segment_id == segments_num, address))
+        self.stream_objects[obj_id][0] = next_segment_id
+        if next_segment_id == segments_num:
+            del self.stream_objects[obj_id]
+            self._complete_object(obj_id, size, start_time)
+        return chunks
+
+    def _receive_segment(self, msg, address):
+        """
+        This method handles a segment received from RDT and gives its view
+        back. It returns the object if the segment completes it, or None.
+
+        The buffer of an object is allocated with its first segment, every
+        segment is written straight from the receive buffer of RDT to its
+        offset in it. The segments of an object that is larger than
+        max_object_size or has too many segments are dropped. An object whose
+        buffer would take the objects being reassembled past
+        max_reassembly_bytes is given up, its segments are dropped.
+        """
+        try:
+            parsed = self._parse_msg(msg)
+            if parsed is None:
+                return None
+            obj_id, size, segment_size, segment_id, body = parsed
+            if obj_id in self.completed_objects:
+                return None
+            reassembly = self.recv_objects.get(obj_id)
+            if reassembly is None:
+                if not fits_reassembly(size, segment_size, self.max_object_size):
+                    return None
+                if self.reassembly_bytes + size > self.max_reassembly_bytes:
+                    self._retire_object(obj_id)
+                    return None
+                reassembly = ObjectReassembly(size, segment_size, address)
+                self.recv_objects[obj_id] = reassembly
+                self.reassembly_bytes += size
+            if not reassembly.add(segment_id, body):
+                return None
+        finally:
+            self.rdt.release_view(msg)
+
+        if reassembly.is_complete():
+            del self.recv_objects[obj_id]
+            self.reassembly_bytes -= size
+            self._complete_object(obj_id, size, reassembly.start_time)
+            return reassembly.data
+        return None
+
+    def _complete_object(self, obj_id, size, start_time):
+        """
+        This method records that an object is completed, with the time at
+        which its first segment was received and the time of its completion.
+        """
+        self.completions.append((obj_id, size, start_time, time.monotonic()))
+        self._retire_object(obj_id)
+
+    def _retire_object(self, obj_id):
+        """
+        This method records that an object is completed or given up, so its
+        late segments are dropped. The objects that expire are given up: their
+        segments received so far are dropped.
+        """
+        if self.completed_objects.add(obj_id):
+            for expired_id in [
+                id for id in self.recv_objects if id in self.completed_objects
+            ]:
+                self.reassembly_bytes -= len(self.recv_objects.pop(expired_id).data)
+            for expired_id in [
+                id for id in self.stream_objects if id in self.completed_objects
+            ]:
+                del self.stream_objects[expired_id]
+
+    def get_completion_stats(self, start=None):
+        """
+        This method returns the completion times of the last received objects
+        and their mean. The completion time of an object is measured from
+        start, a time.monotonic() timestamp such as the time at which the
+        objects were requested, by default from the first segment of the
+        objects that are reported.
+
+        The objects are (obj_id, size, completion time) tuples.
+        """
+        completions = list(self.completions)
+        if not completions:
+            return {"count": 0, "mean": None, "objects": []}
+        if start is None:
+            start = min(start_time for _, _, start_time, _ in completions)
+        objects = [(obj_id, size, end - start) for obj_id, size, _, end in completions]
+        mean = sum(seconds for _, _, seconds in objects) / len(objects)
+        return {"count": len(objects), "mean": mean, "objects": objects}
+
     def close(self):
         """
         This method closes the connection.
@@ -186,5 +507,38 @@ class RDTPlus:
         """
         self.send_obj_id = 0
         self.recv_objects = {}
-        self.recv_objects_ids = []
-        self.completed_objects_ids = []
+        self.reassembly_bytes = 0
+        self.completed_objects = CompletedObjects()
+        self.stream_objects = {}
+        self.completions = deque(maxlen=COMPLETIONS_SIZE)
+
+
+class RDTPlusListener:
+    """
+    This class implements a server that accepts many RDT+ connections on one
+    socket. It is using RDTListener as a base.
+    """
+
+    def __init__(
+        self,
+        sock,
+        congestion_control=CONGESTION_CONTROL,
+        checksum=CHECKSUM,
+        features=FEATURES,
+        pacing=PACING,
+        scheduler=SCHEDULER,
+    ):
+        """
+        This method starts listening on a bound socket.
+        """
+        create_scheduler(scheduler)
+        self.scheduler = scheduler
+        self.listener = RDTListener(
+            sock, congestion_control, checksum, features, pacing
+        )
+
+    def accept(self):
+        """
+        This method waits for a new connection and returns RDT+ protocol over it.
+        """
+        return RDTPlus.from_connection(self.listener.accept(), self.scheduler)
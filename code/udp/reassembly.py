@@ -0,0 +1,180 @@
+"""
+reassembly implements the reassembly of the objects of RDT+. The header of
+every segment carries the size of its object and the size of its segments, so
+the object is received into a buffer allocated once: every segment is written
+at its offset and a bitmap records the received segments.
+
+It also keeps track of the completed objects, so a late segment of an object
+that is already handed over is dropped, in memory that does not grow with the
+number of objects of the connection.
+"""
+
+
+import time
+
+# The number of object ids after the oldest object that is not complete whose
+# completion is recorded. An object this far behind the newest completed object
+# expires: it is given up if it is not complete and its late segments are
+# dropped.
+COMPLETED_WINDOW = 1 << 16
+# The largest object that is reassembled in memory. The buffer of an object is
+# allocated with the size in the header of its first segment, a segment of a
+# larger object is dropped. Larger objects are received with recv_stream.
+MAX_OBJECT_SIZE = 1 << 30
+# The largest number of segments of an object that is reassembled, it bounds
+# the bitmap of the segments of an object whose segment size is tiny.
+MAX_SEGMENTS = 1 << 22
+# The largest number of bytes that the objects of a connection take while they
+# are reassembled. A new object that does not fit is given up, so a peer that
+# starts many large objects and never completes them does not exhaust memory.
+MAX_REASSEMBLY_BYTES = 1 << 31
+
+
+class ObjectReassembly:
+    """
+    This class reassembles an object from its segments. The segments may be
+    received in any order and more than once, the object is complete when
+    every segment is received. The buffer is handed over as the object, it is
+    not copied again.
+
+    It uses the following attributes:
+    data: The buffer of the object, allocated with the size of the object.
+    segment_size: The size of every segment of the object but the last.
+    segments_num: The number of segments of the object.
+    received: A bitmap of the received segments, a bit per segment.
+    missing: The number of segments not received yet.
+    address: The address of the sender of the object.
+    start_time: The time at which the first segment of the object is received.
+    """
+
+    def __init__(self, size, segment_size, address):
+        """
+        This function allocates the buffer of an object of size bytes that is
+        split into segments of segment_size bytes.
+        """
+        self.data = bytearray(size)
+        self.segment_size = segment_size
+        self.segments_num = segments_count(size, segment_size)
+        self.received = bytearray((self.segments_num + 7) // 8)
+        self.missing = self.segments_num
+        self.address = address
+        self.start_time = time.monotonic()
+
+    def add(self, segment_id, body):
+        """
+        This function writes a segment at its offset in the buffer. It returns
+        False for a duplicate segment and for a segment that does not belong
+        to the object.
+        """
+        if segment_id >= self.segments_num:
+            return False
+        offset = segment_id * self.segment_size
+        if len(body) != min(self.segment_size, len(self.data) - offset):
+            return False
+        byte, bit = divmod(segment_id, 8)
+        if self.received[byte] & (1 << bit):
+            return False
+        self.received[byte] |= 1 << bit
+        self.data[offset : offset + len(body)] = body
+        self.missing -= 1
+        return True
+
+    def is_complete(self):
+        """
+        This function returns whether every segment of the object is received.
+        """
+        return self.missing == 0
+
+
+def segments_count(size, segment_size):
+    """
+    This function returns the number of segments of an object of size bytes,
+    at least one so an empty object is sent as an empty segment.
+    """
+    return max(-(-size // segment_size), 1)
+
+
+def fits_reassembly(size, segment_size, max_object_size=MAX_OBJECT_SIZE):
+    """
+    This function returns whether an object of size bytes split into segments
+    of segment_size bytes may be reassembled: it is at most max_object_size
+    bytes and has at most MAX_SEGMENTS segments.
+    """
+    return (
+        size <= max_object_size and segments_count(size, segment_size) <= MAX_SEGMENTS
+    )
+
+
+class CompletedObjects:
+    """
+    This class records the ids of the completed objects of a connection. The
+    ids are given in increasing order by the sender, so the completed ids are
+    recorded as a low watermark, below which every object is completed or
+    expired, and a bitmap of the completed ids of the window after it. An id
+    has the bit of its position modulo the window, so a lookup takes constant
+    time and the memory is bounded by the window.
+
+    An id that completes more than the window after the low watermark slides
+    the window forward: the objects that are left behind expire.
+
+    It uses the following attributes:
+    low: The id below which every object is completed or expired.
+    bits: A bitmap of the completed ids from low, a bit per id of the window.
+    window: The number of ids after low that are recorded.
+    """
+
+    def __init__(self, window=COMPLETED_WINDOW):
+        """
+        This function initializes the record with no completed object.
+        """
+        self.low = 0
+        self.bits = bytearray((window + 7) // 8)
+        self.window = window
+
+    def __contains__(self, obj_id):
+        """
+        This function returns whether the object is completed or expired.
+        """
+        offset = obj_id - self.low
+        return offset < 0 or (offset < self.window and self._is_set(obj_id))
+
+    def _is_set(self, obj_id):
+        """
+        This function returns whether the bit of an id of the window is set.
+        """
+        byte, bit = divmod(obj_id % self.window, 8)
+        return self.bits[byte] & (1 << bit) != 0
+
+    def _set(self, obj_id, value):
+        """
+        This function sets or clears the bit of an id of the window.
+        """
+        byte, bit = divmod(obj_id % self.window, 8)
+        if value:
+            self.bits[byte] |= 1 << bit
+        else:
+            self.bits[byte] &= ~(1 << bit)
+
+    def add(self, obj_id):
+        """
+        This function records that the object is completed. It returns
+        whether objects that are not completed expired, the low watermark
+        moved past them.
+        """
+        offset = obj_id - self.low
+        if offset < 0:
+            return False
+        is_expired = offset >= self.window
+        if is_expired:
+            # The bits of the ids left behind are cleared for the ids that
+            # take their positions.
+            shift = offset - self.window + 1
+            for id in range(self.low, self.low + min(shift, self.window)):
+                self._set(id, False)
+            self.low += shift
+        self._set(obj_id, True)
+        # The low watermark moves past the completed ids at its start.
+        while self._is_set(self.low):
+            self._set(self.low, False)
+            self.low += 1
+        return is_expired
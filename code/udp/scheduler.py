@@ -0,0 +1,260 @@
+"""
+scheduler implements the object schedulers of RDT+. RDT+ interleaves the
+segments of the objects that it sends, a scheduler decides which object sends
+its next segment. The order decides when every object is completed: the upper
+layer waits on the small objects, which round robin completes only after as
+many rounds as they have segments.
+
+Every object has a priority, the objects of the highest priority are served
+first and the scheduler shares the segments between objects of the same
+priority.
+"""
+
+
+import heapq
+from abc import ABC, abstractmethod
+from collections import deque
+
+
+class ObjectScheduler(ABC):
+    """
+    This class is the interface of the object schedulers. The objects are
+    added with their number of segments, next returns the object that sends
+    its next segment until every segment is sent. A subclass that does not
+    implement push, pop and requeue can not be created.
+
+    It uses the following attributes:
+    remaining: A dictionary of the number of segments left to send by object id.
+    """
+
+    def __init__(self):
+        """
+        This function initializes the scheduler with no object.
+        """
+        self.remaining = {}
+
+    def add(self, obj_id, segments_num, priority=0, weight=1):
+        """
+        This function adds an object of segments_num segments. weight is the
+        share of the object among the objects of the same priority, it is
+        only used by weighted fair queuing.
+        """
+        if weight <= 0:
+            raise ValueError(f"invalid weight: {weight}")
+        self.remaining[obj_id] = segments_num
+        self.push(obj_id, priority, weight)
+
+    def next(self):
+        """
+        This function returns the id of the object whose next segment is sent,
+        or None if every segment is sent.
+        """
+        obj_id = self.pop()
+        if obj_id is None:
+            return None
+        self.remaining[obj_id] -= 1
+        if self.remaining[obj_id] == 0:
+            del self.remaining[obj_id]
+        else:
+            self.requeue(obj_id)
+        return obj_id
+
+    def __len__(self):
+        """
+        This function returns the number of objects with segments left to send.
+        """
+        return len(self.remaining)
+
+    @abstractmethod
+    def push(self, obj_id, priority, weight):
+        """
+        This function queues a new object.
+        """
+
+    @abstractmethod
+    def pop(self):
+        """
+        This function takes the object that sends the next segment from the
+        queue, or returns None if the queue is empty.
+        """
+
+    @abstractmethod
+    def requeue(self, obj_id):
+        """
+        This function queues again an object that has segments left to send.
+        """
+
+
+class RoundRobin(ObjectScheduler):
+    """
+    This class sends a segment of every object in turn.
+
+    It uses the following attributes in addition to the attributes of
+    ObjectScheduler:
+    queues: A dictionary of the queues of the objects by priority.
+    priorities: A dictionary of the priority of every object.
+    """
+
+    def __init__(self):
+        """
+        This function initializes the scheduler with no object.
+        """
+        super().__init__()
+        self.queues = {}
+        self.priorities = {}
+
+    def push(self, obj_id, priority, weight):
+        """
+        This function appends a new object to the queue of its priority.
+        """
+        self.priorities[obj_id] = priority
+        self.queues.setdefault(priority, deque()).append(obj_id)
+
+    def pop(self):
+        """
+        This function takes the first object of the highest priority.
+        """
+        if not self.queues:
+            return None
+        priority = max(self.queues)
+        queue = self.queues[priority]
+        obj_id = queue.popleft()
+        if not queue:
+            del self.queues[priority]
+        if self.remaining[obj_id] == 1:
+            del self.priorities[obj_id]
+        return obj_id
+
+    def requeue(self, obj_id):
+        """
+        This function appends the object to the end of the queue of its priority.
+        """
+        priority = self.priorities[obj_id]
+        self.queues.setdefault(priority, deque()).append(obj_id)
+
+
+class ShortestRemainingFirst(ObjectScheduler):
+    """
+    This class sends the segments of the object with the fewest segments left
+    to send first, which minimizes the mean completion time of the objects. An
+    object is sent as a whole unless a shorter object is added meanwhile.
+
+    It uses the following attributes in addition to the attributes of
+    ObjectScheduler:
+    heap: A heap of the objects by priority and number of segments left.
+    order: The number of objects added, it keeps the order of equal objects.
+    entries: A dictionary of the heap entry of every object.
+    """
+
+    def __init__(self):
+        """
+        This function initializes the scheduler with no object.
+        """
+        super().__init__()
+        self.heap = []
+        self.order = 0
+        self.entries = {}
+
+    def push(self, obj_id, priority, weight):
+        """
+        This function queues a new object by its number of segments.
+        """
+        self.entries[obj_id] = [-priority, self.remaining[obj_id], self.order, obj_id]
+        self.order += 1
+        heapq.heappush(self.heap, self.entries[obj_id])
+
+    def pop(self):
+        """
+        This function takes the object of the highest priority with the fewest
+        segments left.
+        """
+        if not self.heap:
+            return None
+        entry = heapq.heappop(self.heap)
+        if self.remaining[entry[3]] == 1:
+            del self.entries[entry[3]]
+        return entry[3]
+
+    def requeue(self, obj_id):
+        """
+        This function queues the object again with its number of segments left.
+        """
+        entry = self.entries[obj_id]
+        entry[1] = self.remaining[obj_id]
+        heapq.heappush(self.heap, entry)
+
+
+class WeightedFairQueuing(ObjectScheduler):
+    """
+    This class shares the segments between the objects in proportion to their
+    weights. Every segment gets a virtual finish time, the segment that
+    finishes first is sent. A new object starts at the current virtual time,
+    so it does not make up for the time before it was added.
+
+    It uses the following attributes in addition to the attributes of
+    ObjectScheduler:
+    heap: A heap of the objects by priority and virtual finish time of their next segment.
+    virtual_time: The virtual finish time of the last sent segment.
+    order: The number of objects added, it keeps the order of equal objects.
+    entries: A dictionary of the heap entry of every object.
+    weights: A dictionary of the weight of every object.
+    """
+
+    def __init__(self):
+        """
+        This function initializes the scheduler with no object.
+        """
+        super().__init__()
+        self.heap = []
+        self.virtual_time = 0.0
+        self.order = 0
+        self.entries = {}
+        self.weights = {}
+
+    def push(self, obj_id, priority, weight):
+        """
+        This function queues a new object from the current virtual time.
+        """
+        self.weights[obj_id] = weight
+        finish = self.virtual_time + 1 / weight
+        self.entries[obj_id] = [-priority, finish, self.order, obj_id]
+        self.order += 1
+        heapq.heappush(self.heap, self.entries[obj_id])
+
+    def pop(self):
+        """
+        This function takes the object of the highest priority whose next
+        segment finishes first.
+        """
+        if not self.heap:
+            return None
+        entry = heapq.heappop(self.heap)
+        self.virtual_time = entry[1]
+        if self.remaining[entry[3]] == 1:
+            del self.entries[entry[3]]
+            del self.weights[entry[3]]
+        return entry[3]
+
+    def requeue(self, obj_id):
+        """
+        This function queues the next segment of the object.
+        """
+        entry = self.entries[obj_id]
+        entry[1] += 1 / self.weights[obj_id]
+        heapq.heappush(self.heap, entry)
+
+
+SCHEDULERS = {
+    "rr": RoundRobin,
+    "srf": ShortestRemainingFirst,
+    "wfq": WeightedFairQueuing,
+}
+
+
+def create_scheduler(name):
+    """
+    This function creates the object scheduler with the given name.
+    """
+    if name not in SCHEDULERS:
+        raise ValueError(f"unknown object scheduler: {name}")
+    return SCHEDULERS[name]()
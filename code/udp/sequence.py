@@ -0,0 +1,45 @@
+"""
+sequence implements the arithmetic of RDT sequence numbers. Sequence numbers
+are 32-bit and wrap around, they are compared with serial number arithmetic
+(RFC 1982): a sequence number comes before another one if the other one is
+less than half of the sequence space ahead of it. Windows are far smaller than
+half of the sequence space, so an old sequence number is never taken for a
+new one after a wrap.
+"""
+
+
+import random
+
+SEQUENCE_BITS = 32
+SEQUENCE_SPACE = 1 << SEQUENCE_BITS
+MAX_SEQUENCE_NUMBER = SEQUENCE_SPACE - 1
+HALF_SEQUENCE_SPACE = SEQUENCE_SPACE // 2
+
+
+def seq_add(id, n):
+    """
+    This function returns the sequence number that is n segments after id.
+    """
+    return (id + n) % SEQUENCE_SPACE
+
+
+def seq_offset(start, id):
+    """
+    This function returns the distance from start to id in the sequence space.
+    """
+    return (id - start) % SEQUENCE_SPACE
+
+
+def seq_before(a, b):
+    """
+    This function returns whether sequence number a comes before b.
+    """
+    return 0 < seq_offset(a, b) < HALF_SEQUENCE_SPACE
+
+
+def random_sequence_number():
+    """
+    This function returns a random initial sequence number, so the segments of
+    an old connection are unlikely to fall in the window of a new one.
+    """
+    return random.getrandbits(SEQUENCE_BITS)
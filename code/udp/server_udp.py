@@ -17,7 +17,8 @@ S -> closes
 
 import socket
 import os
-from rdt_plus import RDTPlus
+import threading
+from rdt_plus import RDTPlusListener
 import hashlib
 
 # setting up the scokcet
@@ -43,28 +44,20 @@ for i in range(10):
         files.append(data)
 
     with open(f"{object_path}/large-{i}.obj.md5", "r") as f:
-        data = f.read()
+        data = f.read().strip()
         print("The read checksum is: ", data)
         checksums.append(data)
     with open(f"{object_path}/small-{i}.obj", "rb") as f:
         files.append(f.read())
     with open(f"{object_path}/small-{i}.obj.md5", "r") as f:
-        checksums.append(f.read())
+        checksums.append(f.read().strip())
 
 
-def main():
+def serve(rdt_plus_server):
     """
-    This is the main function of the server.
-    It creates a socket, binds it to the server address and port and listens for incoming messages.
-    It uses RDTPlus class to send and receive files over the network.
+    This function serves a client over its RDT+ connection.
+    It returns when the client closes the connection.
     """
-    # Create a datagram socket
-    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-    # Bind to address and ip
-    sock.bind(serverAddressPort)
-    print(f"RDT server up and listening on port {localPort}")
-    rdt_plus_server = RDTPlus(sock, True)
-
     while True:
         """
         This loop listens for incoming messages.
@@ -74,19 +67,20 @@ def main():
         If it is "get", it sends the files to the client.
         if it is "ok", it closes the connection.
         """
-        received_message, address = rdt_plus_server.recv()
+        try:
+            received_message, address = rdt_plus_server.recv()
+        except ConnectionError:
+            return
         received_message = received_message.decode("utf-8")
         if received_message == "send":
             rdt_plus_server.send([f"num:{len(files)}".encode("utf-8")], address)
         elif received_message == "get":
             msgs = []
             for file_id in range(len(files)):
-                msg = (
+                header = (
                     f"size:{len(files[file_id])}\nchecksum:{checksums[file_id]}\n\n"
-                    + str(files[file_id])
                 )
-                msg = msg.encode("utf-8")
-                msgs.append(msg)
+                msgs.append(header.encode("utf-8") + files[file_id])
 
             rdt_plus_server.send(msgs, address)
         elif received_message == "ok":
@@ -96,5 +90,23 @@ def main():
             rdt_plus_server.cleanup_server()
 
 
+def main():
+    """
+    This is the main function of the server.
+    It creates a socket, binds it to the server address and port and listens for incoming connections.
+    It uses RDTPlusListener class to accept the clients and serves every client in its own thread.
+    """
+    # Create a datagram socket
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    # Bind to address and ip
+    sock.bind(serverAddressPort)
+    print(f"RDT server up and listening on port {localPort}")
+    listener = RDTPlusListener(sock)
+
+    while True:
+        rdt_plus_server = listener.accept()
+        threading.Thread(target=serve, args=(rdt_plus_server,), daemon=True).start()
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,299 @@
+"""
+timer_wheel implements a hashed timer wheel. It is used by RDT to schedule the
+retransmission timers of all the segments of a connection with a single thread.
+The connections of AsyncRDT in an event loop share a single wheel that the loop
+advances.
+"""
+
+
+import asyncio
+import threading
+import time
+import weakref
+
+TICK_INTERVAL = 0.01
+WHEEL_SIZE = 512
+
+
+class TimerWheel:
+    """
+    This class implements a hashed timer wheel. Each timer is identified by a
+    key and stored in the slot of the tick in which it expires, so arming and
+    cancelling a timer are O(1). A single thread advances the wheel every tick
+    and hands all the timers that expired in that tick to the callback at once.
+
+    It uses the following attributes:
+    callback: The function called with the list of expired keys.
+    tick_interval: The duration of a tick in seconds.
+    wheel_size: The number of slots of the wheel.
+    slots: A list of dictionaries mapping the keys to their deadlines.
+    key_slots: A dictionary mapping the armed keys to their slots.
+    current_tick: The last tick processed by the wheel thread.
+    stopped: A boolean indicating whether the wheel is stopped.
+    mutex: A mutex used for synchronization.
+    condition: A condition variable used to wake up the wheel thread.
+    thread: The thread that advances the wheel.
+    """
+
+    def __init__(self, callback, tick_interval=TICK_INTERVAL, wheel_size=WHEEL_SIZE):
+        """
+        This function initializes the timer wheel and starts its thread.
+        """
+        self.callback = callback
+        self.tick_interval = tick_interval
+        self.wheel_size = wheel_size
+        self.slots = [{} for _ in range(wheel_size)]
+        self.key_slots = {}
+        self.current_tick = self._tick(time.monotonic())
+        self.stopped = False
+
+        self.mutex = threading.Lock()
+        self.condition = threading.Condition(self.mutex)
+
+        self.start()
+
+    def start(self):
+        """
+        This function starts the thread that advances the wheel.
+        """
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        """
+        This function returns the number of armed timers.
+        """
+        return len(self.key_slots)
+
+    def __contains__(self, key):
+        """
+        This function returns whether a timer is armed for the key.
+        """
+        return key in self.key_slots
+
+    def _tick(self, now):
+        """
+        This function returns the tick that contains the given time.
+        """
+        return int(now / self.tick_interval)
+
+    def arm(self, key, interval):
+        """
+        This function arms the timer of the key to expire after the interval.
+        If the timer of the key is already armed, it is rearmed.
+        """
+        deadline = time.monotonic() + interval
+        with self.mutex:
+            slot = self.key_slots.pop(key, None)
+            if slot is not None:
+                self.slots[slot].pop(key, None)
+
+            # A timer always expires in a tick that is not processed yet.
+            tick = max(self._tick(deadline) + 1, self.current_tick + 1)
+            slot = tick % self.wheel_size
+            self.slots[slot][key] = deadline
+            self.key_slots[key] = slot
+            if len(self.key_slots) == 1:
+                self.condition.notify()
+
+    def cancel(self, key):
+        """
+        This function cancels the timer of the key if it is armed.
+        """
+        with self.mutex:
+            slot = self.key_slots.pop(key, None)
+            if slot is not None:
+                self.slots[slot].pop(key, None)
+
+    def stop(self):
+        """
+        This function cancels all the timers and stops the wheel thread.
+        """
+        with self.mutex:
+            self.stopped = True
+            for slot in self.key_slots.values():
+                self.slots[slot].clear()
+            self.key_slots.clear()
+            self.condition.notify()
+
+    def _expire(self, now):
+        """
+        This function advances the wheel up to the current time and returns the
+        keys of the expired timers. It is called with the mutex held.
+
+        A slot may contain timers of later rounds of the wheel, they are kept
+        until their deadline is reached.
+        """
+        expired = []
+        now_tick = self._tick(now)
+        ticks = min(now_tick - self.current_tick, self.wheel_size)
+        for tick in range(self.current_tick + 1, self.current_tick + ticks + 1):
+            slot = self.slots[tick % self.wheel_size]
+            if not slot:
+                continue
+            for key, deadline in list(slot.items()):
+                if deadline <= now:
+                    del slot[key]
+                    del self.key_slots[key]
+                    expired.append(key)
+        self.current_tick = max(self.current_tick, now_tick)
+        return expired
+
+    def _run(self):
+        """
+        This function is the target of the wheel thread. It sleeps while no
+        timer is armed, otherwise it wakes up every tick and passes the expired
+        keys to the callback in a single call.
+        """
+        while True:
+            with self.mutex:
+                if self.stopped:
+                    return
+                if len(self.key_slots) == 0:
+                    self.condition.wait()
+                    self.current_tick = self._tick(time.monotonic())
+                    continue
+                self.condition.wait(self.tick_interval)
+                expired = self._expire(time.monotonic())
+
+            if expired:
+                self.callback(expired)
+
+
+class LoopTimerWheel(TimerWheel):
+    """
+    This class runs a hashed timer wheel in an asyncio event loop instead of a
+    thread. It is shared by the connections of the loop, every timer is keyed
+    by the LoopTimers of its connection and its own key. The loop advances the
+    wheel every tick while a timer is armed, a tick costs only the timers of
+    its slot, so the armed timers of idle connections cost nothing. It must be
+    created in the event loop, get_loop_timer_wheel returns the wheel of the
+    running loop.
+
+    It uses the following attributes:
+    loop: The event loop that advances the wheel.
+    handle: The handle of the next tick, or None while no timer is armed.
+    """
+
+    def start(self):
+        """
+        This function attaches the wheel to the running event loop.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.handle = None
+
+    def arm(self, key, interval):
+        """
+        This function arms the timer of the key to expire after the interval.
+        The first armed timer schedules the next tick of the wheel.
+        """
+        if self.handle is None:
+            self.current_tick = self._tick(time.monotonic())
+        super().arm(key, interval)
+        if self.handle is None and not self.stopped:
+            self.handle = self.loop.call_later(self.tick_interval, self._run)
+
+    def stop(self):
+        """
+        This function cancels all the timers and the next tick.
+        """
+        super().stop()
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def _run(self):
+        """
+        This function advances the wheel by a tick and passes the expired keys
+        of every connection to its callback in a single call. The next tick is
+        scheduled while a timer is armed, even if a callback fails.
+        """
+        with self.mutex:
+            expired = self._expire(time.monotonic())
+        batches = {}
+        for timers, key in expired:
+            timers.keys.discard(key)
+            batches.setdefault(timers, []).append(key)
+        try:
+            for timers, keys in batches.items():
+                timers.callback(keys)
+        finally:
+            if self.key_slots and not self.stopped:
+                self.handle = self.loop.call_later(self.tick_interval, self._run)
+            else:
+                self.handle = None
+
+
+# The timer wheel of every event loop, it is removed with its loop.
+LOOP_TIMER_WHEELS = weakref.WeakKeyDictionary()
+
+
+def get_loop_timer_wheel():
+    """
+    This function returns the timer wheel of the running event loop, created
+    when it is first used.
+    """
+    loop = asyncio.get_running_loop()
+    wheel = LOOP_TIMER_WHEELS.get(loop)
+    if wheel is None:
+        wheel = LoopTimerWheel(None)
+        LOOP_TIMER_WHEELS[loop] = wheel
+    return wheel
+
+
+class LoopTimers:
+    """
+    This class schedules the timers of a connection on the timer wheel of its
+    event loop. It has the interface of TimerWheel: the expired keys of a tick
+    are passed to the callback in a single call.
+
+    It uses the following attributes:
+    callback: The function called with the list of expired keys.
+    wheel: The timer wheel of the event loop.
+    keys: A set of the armed keys.
+    """
+
+    def __init__(self, callback):
+        """
+        This function initializes the timers of a connection. It must be
+        called in the event loop.
+        """
+        self.callback = callback
+        self.wheel = get_loop_timer_wheel()
+        self.keys = set()
+
+    def __len__(self):
+        """
+        This function returns the number of armed timers.
+        """
+        return len(self.keys)
+
+    def __contains__(self, key):
+        """
+        This function returns whether a timer is armed for the key.
+        """
+        return key in self.keys
+
+    def arm(self, key, interval):
+        """
+        This function arms the timer of the key to expire after the interval.
+        If the timer of the key is already armed, it is rearmed.
+        """
+        self.keys.add(key)
+        self.wheel.arm((self, key), interval)
+
+    def cancel(self, key):
+        """
+        This function cancels the timer of the key if it is armed.
+        """
+        if key in self.keys:
+            self.keys.discard(key)
+            self.wheel.cancel((self, key))
+
+    def stop(self):
+        """
+        This function cancels all the timers of the connection.
+        """
+        for key in self.keys:
+            self.wheel.cancel((self, key))
+        self.keys.clear()
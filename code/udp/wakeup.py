@@ -0,0 +1,60 @@
+"""
+wakeup implements the wake-up of the sending thread of RDT. The sending thread
+waits with the mutex of the connection released, but it is woken up by threads
+that do not hold the mutex: the application that queues messages holds only
+the lock of the send buffer. A condition variable must be notified with its
+lock held, an event is set by any thread without a lock.
+"""
+
+
+import threading
+
+
+class Wakeup:
+    """
+    This class wakes up a single thread that waits with a lock released. It
+    has the notify and wait methods of a condition variable, but notify may be
+    called without the lock.
+
+    A notification is kept until the waiting thread wakes up, so it is not
+    lost if it comes between the check of the waiting thread and its wait.
+    The waiting thread checks its condition again after it wakes up.
+
+    It uses the following attributes:
+    lock: The lock that is released while the thread waits.
+    event: The event that is set by notify.
+    """
+
+    def __init__(self, lock):
+        """
+        This function initializes the wake-up of a thread that waits with the
+        lock released.
+        """
+        self.lock = lock
+        self.event = threading.Event()
+
+    def notify(self):
+        """
+        This function wakes up the waiting thread, or the next thread that
+        waits. The lock need not be held.
+        """
+        self.event.set()
+
+    def notify_all(self):
+        """
+        This function wakes up the waiting thread, as notify does.
+        """
+        self.event.set()
+
+    def wait(self, timeout=None):
+        """
+        This function is called with the lock held. It releases the lock,
+        waits for a notification for at most timeout seconds if it is given
+        and acquires the lock again.
+        """
+        self.lock.release()
+        try:
+            self.event.wait(timeout)
+            self.event.clear()
+        finally:
+            self.lock.acquire()